@@ -0,0 +1,87 @@
+'''
+Broad phase benchmark
+=====================
+
+Times one tick worth of particle pair tests for every broad phase against the
+nested loop tick used before broad phases existed. Runs without Kivy.
+
+    python bench/broadphase.py
+    python bench/broadphase.py --scene pile --counts 200 500 1000 2000
+
+'gas' spreads particles over the whole box like the default scene, 'pile'
+packs them into the bottom of the box like holding Shift does.
+'''
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from physics import Particle
+from broadphase import BruteForce, SpatialHash, SweepAndPrune, QuadTree, SortedGrid
+
+
+W, H = 800, 550
+
+
+def scene(kind, n, speed=3, size=20):
+    if kind == 'gas':
+        h = H
+    else:
+        # Roughly the height a settled (and squashed) pile of n particles reaches
+        h = min(H, n * size**2 / W)
+    return [Particle(random.random() * (W - 2 * size), random.random() * h, speed, size, i, W, H)
+            for i in range(n)]
+
+
+def nested(particles):
+    hits = 0
+    for i, p1 in enumerate(particles):
+        for p2 in particles[i + 1:]:
+            hits += p1.check_collision(p2)
+    return hits
+
+
+def broad(bp, particles):
+    hits = 0
+    for i, j in bp.pairs([p.pos for p in particles], [p.size[0] for p in particles]):
+        hits += particles[i].check_collision(particles[j])
+    return hits
+
+
+def best(f, repeat):
+    t = []
+    for _ in range(repeat):
+        s = time.perf_counter()
+        r = f()
+        t += [time.perf_counter() - s]
+    return min(t), r
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scene', choices=['gas', 'pile'], default='pile')
+    parser.add_argument('--counts', type=int, nargs='+', default=[200, 500, 1000, 2000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    phases = [SortedGrid(), SpatialHash(), SweepAndPrune(), QuadTree(), BruteForce()]
+    print('%-8s %-18s %10s %8s' % ('n', 'method', 'ms', 'hits'))
+    for n in args.counts:
+        random.seed(args.seed)
+        particles = scene(args.scene, n)
+
+        t, hits = best(lambda: nested(particles), args.repeat)
+        print('%-8d %-18s %10.2f %8d' % (n, 'nested loop', t * 1000, hits))
+        for bp in phases:
+            t, h = best(lambda: broad(bp, particles), args.repeat)
+            assert h == hits, bp.name
+            print('%-8d %-18s %10.2f %8d' % (n, bp.name, t * 1000, h))
+
+
+if __name__ == '__main__':
+    main()
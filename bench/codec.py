@@ -0,0 +1,88 @@
+'''
+Codec benchmark
+===============
+
+Records a seeded World for a number of steps and writes its positions with
+CompressedWriter at several quantization and keyframe settings, reporting the
+compression ratio against raw float64 positions, the largest position error,
+and encode, sequential decode and random seek speeds in MB/s of raw positions.
+Runs without Kivy.
+
+    python bench/codec.py
+    python bench/codec.py --particles 10000 --steps 600 --bits 12 16 20 --keyframes 1 30 120
+'''
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import numpy as np
+
+from world import World
+from codec import CompressedWriter, CompressedReader
+
+
+W, H = 800, 550
+
+
+def frames(n, steps, seed):
+    world = World(W, H, seed)
+    world.add(n)
+    out = []
+    for _ in range(steps):
+        world.step()
+        out += [world.particles.pos.copy()]
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--particles', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=600)
+    parser.add_argument('--bits', type=int, nargs='+', default=[12, 16, 20])
+    parser.add_argument('--keyframes', type=int, nargs='+', default=[1, 60, 240])
+    parser.add_argument('--seeks', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    pos = frames(args.particles, args.steps, args.seed)
+    raw = sum(p.nbytes for p in pos)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.ptz')
+    print('%d particles, %d steps, %.1f MB of positions' % (args.particles, args.steps, raw / 1e6))
+    print('%5s %9s %8s %10s %11s %11s %11s' % ('bits', 'keyframe', 'ratio', 'max err', 'encode MB/s',
+                                              'decode MB/s', 'seek MB/s'))
+    for bits in args.bits:
+        for keyframe in args.keyframes:
+            s = time.perf_counter()
+            out = CompressedWriter(path, W, H, bits, keyframe)
+            for i, p in enumerate(pos):
+                out.append(i, p)
+            out.close()
+            encode = time.perf_counter() - s
+
+            r = CompressedReader(path)
+            s = time.perf_counter()
+            err = max(np.abs(r[i][1] - p).max() for i, p in enumerate(pos))
+            decode = time.perf_counter() - s
+
+            rng = random.Random(args.seed)
+            seeks = [rng.randrange(len(r)) for _ in range(args.seeks)]
+            s = time.perf_counter()
+            for i in seeks:
+                r[i]
+            seek = time.perf_counter() - s
+            r.close()
+
+            print('%5d %9d %8.1f %10.4f %11.1f %11.1f %11.1f' % (
+                bits, keyframe, raw / os.path.getsize(path), err, raw / encode / 1e6, raw / decode / 1e6,
+                raw / len(pos) * len(seeks) / seek / 1e6))
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+Domain decomposition benchmark
+==============================
+
+Steps the same scene with one World and with ParallelWorld on 1 to N worker
+processes, and prints the time per step, the speed up over one World and how
+far the parallel positions ended up from the single process ones. Runs
+without Kivy.
+
+    python bench/domain.py
+    python bench/domain.py --particles 5000 --workers 1 2 4 8 --grav
+'''
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import numpy as np
+
+from world import World
+from domain import ParallelWorld
+
+
+W, H = 800, 550
+
+
+def run(world, steps):
+    world.step()
+    s = time.perf_counter()
+    for _ in range(steps):
+        world.step()
+    return (time.perf_counter() - s) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--particles', type=int, default=2000)
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--workers', type=int, nargs='+', default=list(range(1, os.cpu_count() + 1)))
+    parser.add_argument('--grav', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    base = World(W, H, args.seed)
+    base.grav = args.grav
+    base.add(args.particles)
+
+    t1 = run(base, args.steps)
+    print('%d particles, %d cores' % (args.particles, os.cpu_count()))
+    print('%-8s %10s %8s %10s %8s %8s' % ('workers', 'ms/step', 'speedup', 'max diff', 'halo', 'migrated'))
+    print('%-8s %10.2f %8.2f %10s %8s %8s' % ('world', t1 * 1000, 1, '-', '-', '-'))
+
+    for k in args.workers:
+        ref = World(W, H, args.seed)
+        ref.grav = args.grav
+        ref.add(args.particles)
+        world = ParallelWorld(W, H, k)
+        world.grav = args.grav
+        world.particles.extend(list(ref.particles))
+        t = run(world, args.steps)
+        for _ in range(args.steps + 1):
+            ref.step()
+        diff = np.abs(world.particles.pos - ref.particles.pos).max()
+        print('%-8d %10.2f %8.2f %10.3g %8d %8d' % (k, t * 1000, t1 / t, diff, sum(world.halo), world.migrated))
+        world.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+'''
+Kernel benchmark
+================
+
+Times each collision and integration hot path on its own, in its per particle
+Python form and its NumPy form, plus a full World.step for each backend, over
+a range of particle and polygon counts. Scenes are seeded, so every run times
+the same work, and the results can be written as JSON or CSV to compare
+versions. Runs without Kivy.
+
+    python bench/kernels.py
+    python bench/kernels.py --counts 100 1000 10000 100000 --polygons 0 20 --json kernels.json
+
+The box grows with the particle count so the density, and with it the number
+of colliding pairs per particle, stays the same at every count. The Python
+forms are skipped above --python-max particles, where they take minutes.
+
+The backends are different collision models, so their steps only agree on
+scenes where those models do. --check steps such a scene, isolated pairs of
+equal size particles among polygons, once with every backend and fails when
+any of them strays from the numpy one:
+
+    python bench/kernels.py --check
+'''
+
+import os
+import sys
+import csv
+import json
+import time
+import math as m
+import argparse
+import platform
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import numpy as np
+
+from world import World, PythonWorld
+from broadphase import SpatialHash
+from narrow import collide_pairs, collide_polygons, PolygonTable
+from bvh import EdgeTree
+from backends import BACKENDS
+
+
+# Box at 1000 particles, about as crowded as the app with a few hundred
+W, H = 800, 550
+SIZE = 20
+
+
+def box(n):
+    k = m.sqrt(max(n, 1) / 1000)
+    return W * k, H * k
+
+
+def scene(n, polygons, seed, cls=World):
+    w, h = box(n)
+    world = cls(w, h, seed=seed)
+    world.add(n)
+    add_polygons(world, polygons)
+    return world
+
+
+def add_polygons(world, polygons):
+    rng = world.rng
+    for k in range(polygons):
+        cx, cy = rng.random() * world.w, rng.random() * world.h
+        e = rng.randint(3, 8)
+        r = 2 * SIZE * (0.5 + rng.random())
+        world.add_polygon([(cx + r * m.cos(2 * m.pi * i / e), cy + r * m.sin(2 * m.pi * i / e)) for i in range(e)])
+
+
+def pair_scene(pairs, polygons, seed, cls=World):
+    # Pairs of overlapping particles of the same size, each alone in a cell of
+    # a grid. Within a pair both models exchange the same velocities and push
+    # along the same line, and no particle is in two pairs, so the steps agree
+    # up to rounding. Polygon collisions are the same in every backend.
+    k = m.ceil(m.sqrt(pairs))
+    cell = 5 * SIZE
+    world = cls(k * cell, k * cell, seed=seed)
+    world.add(2 * pairs)
+    st = world.particles
+    rng = world.rng
+    st.size[:] = SIZE
+    for i in range(pairs):
+        x, y = (i % k + 0.5) * cell - SIZE / 2, (i // k + 0.5) * cell - SIZE / 2
+        a = rng.random() * 2 * m.pi
+        d = SIZE * (0.5 + 0.4 * rng.random())
+        st.pos[2 * i] = x, y
+        st.pos[2 * i + 1] = x + d * m.cos(a), y + d * m.sin(a)
+    add_polygons(world, polygons)
+    return world
+
+
+def check(names, seed, tolerance=1e-9):
+    # Steps the same pair scene with every backend and compares each with numpy
+    out = {}
+    for name in names:
+        world = pair_scene(500, 40, seed, BACKENDS[name])
+        world.step()
+        out[name] = world.particles.pos.copy(), world.particles.vel.copy()
+        world.close()
+    pos, vel = out['numpy']
+    ok = True
+    for name, (p, v) in out.items():
+        err = max(np.abs(p - pos).max(), np.abs(v - vel).max())
+        print('%-9s max difference from numpy %.3g' % (name, err))
+        ok &= bool(err <= tolerance)
+    return ok
+
+
+def pairs(world):
+    st = world.particles
+    return SpatialHash().pairs(st.pos.tolist(), st.size.tolist())
+
+
+# Each kernel takes a fresh world and returns (function to time, items it
+# processes), so setting up is never timed and nothing carries over between
+# repeats
+
+def check_collision_python(world):
+    ps = list(world.particles)
+    pp = [(ps[i], ps[j]) for i, j in pairs(world)]
+    return lambda: [a.check_collision(b) for a, b in pp], len(pp)
+
+
+def p_collision_python(world):
+    ps = list(world.particles)
+    pp = [(ps[i], ps[j]) for i, j in pairs(world)]
+    return lambda: [world.p_collision(a, b) for a, b in pp], len(pp)
+
+
+def p_collision_numpy(world):
+    pp = pairs(world)
+    return lambda: collide_pairs(world.particles, pp, world.e_loss), len(pp)
+
+
+def polygon_python(world):
+    ps = list(world.particles)
+    tree = EdgeTree(world.polygons)
+    return lambda: [t.check_collision(p, edges) for p in ps for t, edges in tree.query(p)], len(ps) * len(world.polygons)
+
+
+def polygon_numpy(world):
+    table = PolygonTable(world.polygons)
+    return lambda: collide_polygons(world.particles, table, world.e_loss), len(world.particles) * len(world.polygons)
+
+
+def wall_python(world):
+    ps = list(world.particles)
+    return lambda: [PythonWorld.wall_collision_one(world, p) for p in ps], len(ps)
+
+
+def wall_numpy(world):
+    return lambda: world.wall_collision(world.particles), len(world.particles)
+
+
+KERNELS = [
+    # kernel, implementation, function, uses polygons
+    ('check_collision', 'python', check_collision_python, False),
+    ('p_collision', 'python', p_collision_python, False),
+    ('p_collision', 'numpy', p_collision_numpy, False),
+    ('polygon', 'python', polygon_python, True),
+    ('polygon', 'numpy', polygon_numpy, True),
+    ('wall_collision', 'python', wall_python, False),
+    ('wall_collision', 'numpy', wall_numpy, False),
+]
+
+
+def timed(make, repeat):
+    t = []
+    for _ in range(repeat):
+        f, items = make()
+        s = time.perf_counter()
+        f()
+        t += [time.perf_counter() - s]
+    return t, items
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--polygons', type=int, nargs='+', default=[0, 10])
+    parser.add_argument('--backends', choices=sorted(BACKENDS), nargs='+', default=['python', 'numpy'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--python-max', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json')
+    parser.add_argument('--csv')
+    parser.add_argument('--check', action='store_true', help='only check the backends agree on a pair scene')
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(0 if check(sorted(BACKENDS), args.seed) else 1)
+
+    rows = []
+
+    def report(kernel, impl, n, polygons, t, items):
+        row = {'kernel': kernel, 'impl': impl, 'particles': n, 'polygons': polygons, 'items': items,
+               'best_ms': min(t) * 1000, 'mean_ms': sum(t) / len(t) * 1000,
+               'ns_per_item': min(t) / max(items, 1) * 1e9}
+        rows.append(row)
+        print('%-16s %-9s %8d %8d %10d %10.3f %10.3f %10.1f' % tuple(row.values()))
+
+    print('%-16s %-9s %8s %8s %10s %10s %10s %10s' % tuple(
+        ['kernel', 'impl', 'n', 'polygons', 'items', 'best ms', 'mean ms', 'ns/item']))
+    for n in args.counts:
+        for i, p in enumerate(args.polygons):
+            for kernel, impl, make, poly in KERNELS:
+                if impl == 'python' and n > args.python_max:
+                    continue
+                # Kernels without polygons only need timing once per count
+                if poly != bool(p) or (not poly and i):
+                    continue
+                t, items = timed(lambda: make(scene(n, p, args.seed)), args.repeat)
+                report(kernel, impl, n, p, t, items)
+
+            for name in args.backends:
+                if name == 'python' and n > args.python_max:
+                    continue
+                world = scene(n, p, args.seed, BACKENDS[name])
+                world.step()
+                t = []
+                for _ in range(args.repeat):
+                    s = time.perf_counter()
+                    world.step()
+                    t += [time.perf_counter() - s]
+                world.close()
+                report('step', name, n, p, t, n)
+
+    meta = {'seed': args.seed, 'repeat': args.repeat, 'version': version(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(), 'cpus': os.cpu_count()}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': meta, 'results': rows}, f, indent=1)
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            out = csv.DictWriter(f, fieldnames=list(rows[0]))
+            out.writeheader()
+            out.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
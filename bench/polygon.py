@@ -0,0 +1,123 @@
+'''
+Polygon collision benchmark
+===========================
+
+Times Polygon.check_collision against the original implementation, which
+worked out every edge's line, bisector and length on each call, and against the
+vectorised narrow.polygon_hits kernel over polygon_candidates. Runs without Kivy.
+
+    python bench/polygon.py
+    python bench/polygon.py --polygons 300 --particles 2000
+'''
+
+import os
+import sys
+import time
+import math as m
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from physics import Particle, Polygon
+from store import ParticleStore
+from narrow import PolygonTable, polygon_candidates, polygon_hits
+
+
+W, H = 800, 550
+
+
+def original_check_collision(self, p):
+    # Polygon.check_collision as it was before edge geometry was precomputed
+    pw, ph = p.size
+    px, py = p.pos[0] + pw / 2, p.pos[1] + ph / 2
+
+    d = []
+    l = []
+    hit = []
+    for i in range(len(self.vertex)):
+        j = (i + 1) % len(self.vertex)
+        x0, y0 = (self.vertex[i][0] + self.vertex[j][0]) / 2, (self.vertex[i][1] + self.vertex[j][1]) / 2
+        if self.normal[i][1] != 0:
+            m_1 = - self.normal[i][0] / self.normal[i][1]
+            b_2 = self.vertex[i][1] - m_1 * self.vertex[i][0]
+            d += [abs(-m_1 * px + py - b_2) / m.sqrt(1 + m_1**2)]
+
+            if m_1 != 0:
+                m_2 = -1 / m_1
+                b_2 = y0 - m_2 * x0
+                l += [abs(-m_2 * px + py - b_2) / m.sqrt(1 + m_2**2)]
+            else:
+                l += [abs(x0 - px)]
+        else:
+            d += [abs(x0 - px)]
+            l += [abs(y0 - py)]
+
+        w = m.sqrt((self.vertex[i][0] - self.vertex[j][0])**2 + (self.vertex[i][1] - self.vertex[j][1])**2)
+        hit += [0]
+        if d[i] <= pw / 2 and l[i] <= w / 2 + pw / 2:
+            hit[i] = 1
+
+    s = sum(hit)
+    if s == 0:
+        return False
+    for i in range(len(self.vertex)):
+        if s == 1:
+            if hit[i]:
+                return (i, pw / 2 - d[i] + 1)
+        if s > 1:
+            j = (i + 1) % len(self.vertex)
+            if hit[i] and hit[j]:
+                if self.normal[i][0]*p.vel[0]+self.normal[i][1]*p.vel[1] < self.normal[j][0]*p.vel[0]+self.normal[j][1]*p.vel[1]:
+                    return (i, 1)
+                return (j, 1)
+
+
+def polygons(n, size=40):
+    out = []
+    for k in range(n):
+        cx, cy = random.random() * W, random.random() * H
+        e = random.randint(3, 8)
+        out += [Polygon([(cx + size * (0.5 + random.random()) * m.cos(2 * m.pi * i / e),
+                          cy + size * (0.5 + random.random()) * m.sin(2 * m.pi * i / e)) for i in range(e)], k)]
+    return out
+
+
+def run(f, polys, particles):
+    s = time.perf_counter()
+    out = [f(t, p) for t in polys for p in particles]
+    return time.perf_counter() - s, out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--polygons', type=int, default=100)
+    parser.add_argument('--particles', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    polys = polygons(args.polygons)
+    particles = [Particle(random.random() * W, random.random() * H, 3, 20, i, W, H) for i in range(args.particles)]
+
+    t_old, old = run(original_check_collision, polys, particles)
+    t_new, new = run(Polygon.check_collision, polys, particles)
+    for a, b in zip(old, new):
+        assert bool(a) == bool(b) and (not a or (a[0] == b[0] and abs(a[1] - b[1]) < 1e-6))
+
+    st = ParticleStore()
+    st.extend(particles)
+    s = time.perf_counter()
+    table = PolygonTable(polys)
+    hits = len(polygon_hits(table, st.pos, st.size, st.vel, *polygon_candidates(table, st.pos, st.size))[0])
+    t_vec = time.perf_counter() - s
+    assert hits == sum(1 for a in new if a)
+
+    tests = args.polygons * args.particles
+    print('%d polygons x %d particles, %d hits' % (args.polygons, args.particles, hits))
+    for name, t in (('original', t_old), ('precomputed', t_new), ('vectorised', t_vec)):
+        print('%-12s %10.2f ms %8.3f us/test %6.1fx' % (name, t * 1000, t / tests * 1e6, t_old / t))
+
+
+if __name__ == '__main__':
+    main()
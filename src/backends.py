@@ -0,0 +1,27 @@
+import os
+
+from world import World, PythonWorld
+from domain import ParallelWorld
+
+
+# Every backend is a World with the same interface (add, sub, add_polygon,
+# step, close and the particles store), so the app, the runners and the
+# benchmarks pick one by name and never depend on which it is. python resolves
+# particle pairs with a different model from the other two, so its steps only
+# match theirs on scenes of isolated, equal size pairs.
+#   python:   one particle or pair at a time, pairs resolved in turn
+#   numpy:    batch kernels over the whole ParticleStore
+#   parallel: numpy kernels on strips of the box in worker processes
+BACKENDS = {
+    'python': PythonWorld,
+    'numpy': World,
+    'parallel': ParallelWorld,
+}
+
+
+def default_backend():
+    # PARTICLE_BOX_BACKEND picks the backend when no flag does
+    name = os.environ.get('PARTICLE_BOX_BACKEND', 'numpy')
+    if name not in BACKENDS:
+        raise ValueError('PARTICLE_BOX_BACKEND is %r, not one of %s' % (name, ', '.join(sorted(BACKENDS))))
+    return name
@@ -0,0 +1,213 @@
+import math as m
+
+import numpy as np
+
+
+# A broad phase takes particle positions (bottom left corner, as in Particle.pos)
+# and diameters and returns the index pairs (i, j), i < j, that may be touching.
+# The exact test is still left to Particle.check_collision. Broad phases with a
+# pair_array method also take the arrays of a ParticleStore and return the
+# pairs as a (k, 2) index array sorted by i and then j.
+
+class BruteForce:
+    name = 'brute force'
+
+    def pairs(self, pos, size):
+        n = len(pos)
+        return [(i, j) for i in range(n) for j in range(i + 1, n)]
+
+
+class SpatialHash:
+    name = 'spatial hash'
+
+    # Only half of the 3x3 neighbourhood is visited so every pair of cells is seen once
+    neighbours = ((1, -1), (1, 0), (1, 1), (0, 1))
+
+    def pairs(self, pos, size):
+        if not size:
+            return []
+        cell = max(size)
+
+        grid = {}
+        for i, (x, y) in enumerate(pos):
+            r = size[i] / 2
+            key = (m.floor((x + r) / cell), m.floor((y + r) / cell))
+            if key in grid:
+                grid[key].append(i)
+            else:
+                grid[key] = [i]
+
+        out = []
+        for (cx, cy), a in grid.items():
+            for k, i in enumerate(a):
+                for j in a[k + 1:]:
+                    out.append((i, j) if i < j else (j, i))
+            for dx, dy in self.neighbours:
+                b = grid.get((cx + dx, cy + dy))
+                if b:
+                    for i in a:
+                        for j in b:
+                            out.append((i, j) if i < j else (j, i))
+        return out
+
+
+class SweepAndPrune:
+    name = 'sweep and prune'
+
+    def __init__(self):
+        self.order = []
+
+    def sort(self, pos):
+        # Particles only move a few pixels per tick so the order from the last
+        # tick is nearly sorted and insertion sort is close to linear
+        n = len(pos)
+        order = [i for i in self.order if i < n]
+        if len(order) < n:
+            order += range(len(order), n)
+
+        for k in range(1, n):
+            i = order[k]
+            x = pos[i][0]
+            j = k - 1
+            while j >= 0 and pos[order[j]][0] > x:
+                order[j + 1] = order[j]
+                j -= 1
+            order[j + 1] = i
+        self.order = order
+        return order
+
+    def pairs(self, pos, size):
+        order = self.sort(pos)
+
+        n = len(order)
+        out = []
+        for k, i in enumerate(order):
+            x1, y1 = pos[i]
+            r1 = x1 + size[i]
+            t1 = y1 + size[i]
+            k += 1
+            while k < n:
+                j = order[k]
+                x2, y2 = pos[j]
+                if x2 > r1:
+                    break
+                if y2 <= t1 and y1 <= y2 + size[j]:
+                    out.append((i, j) if i < j else (j, i))
+                k += 1
+        return out
+
+
+class QuadTree:
+    name = 'quadtree'
+
+    def __init__(self, capacity=8, depth=12):
+        self.capacity = capacity
+        self.depth = depth
+
+    def build(self, items, cx, cy, x0, y0, x1, y1, depth):
+        # Nodes are [x0, y0, x1, y1, items, children], items only on leaves
+        if len(items) <= self.capacity or depth == self.depth:
+            return [x0, y0, x1, y1, items, None]
+
+        xm = (x0 + x1) / 2
+        ym = (y0 + y1) / 2
+        q = ([], [], [], [])
+        for i in items:
+            q[(cx[i] >= xm) + 2 * (cy[i] >= ym)].append(i)
+        return [x0, y0, x1, y1, None,
+                [self.build(q[0], cx, cy, x0, y0, xm, ym, depth + 1),
+                 self.build(q[1], cx, cy, xm, y0, x1, ym, depth + 1),
+                 self.build(q[2], cx, cy, x0, ym, xm, y1, depth + 1),
+                 self.build(q[3], cx, cy, xm, ym, x1, y1, depth + 1)]]
+
+    def pairs(self, pos, size):
+        n = len(pos)
+        if n < 2:
+            return []
+
+        # The tree is built over particle centres and bounds taken from the data,
+        # so dense regions like a gravity pile are split deeper than empty ones
+        cx = [pos[i][0] + size[i] / 2 for i in range(n)]
+        cy = [pos[i][1] + size[i] / 2 for i in range(n)]
+        root = self.build(list(range(n)), cx, cy, min(cx), min(cy), max(cx), max(cy), 0)
+        r = max(size) / 2
+
+        out = []
+        for i in range(n):
+            # Any particle touching i has its centre within this box
+            e = size[i] / 2 + r
+            qx0, qy0, qx1, qy1 = cx[i] - e, cy[i] - e, cx[i] + e, cy[i] + e
+            stack = [root]
+            while stack:
+                x0, y0, x1, y1, items, children = stack.pop()
+                if x0 > qx1 or x1 < qx0 or y0 > qy1 or y1 < qy0:
+                    continue
+                if children:
+                    stack += children
+                    continue
+                for j in items:
+                    if j > i and qx0 <= cx[j] <= qx1 and qy0 <= cy[j] <= qy1:
+                        out.append((i, j))
+        return out
+
+
+class SortedGrid:
+    # SpatialHash with NumPy: particles are sorted by the key of the cell their
+    # centre is in, so each cell is a run of the sorted particles and a
+    # neighbouring cell's run is found with searchsorted. Pairs are expanded
+    # and filtered with whole array operations, so nothing is done per particle
+    # in Python.
+    name = 'sorted grid'
+
+    # The cell itself and half of its 3x3 neighbourhood, so every pair of cells is seen once
+    neighbours = ((1, -1), (1, 0), (1, 1), (0, 1))
+
+    def pairs(self, pos, size):
+        return [tuple(p) for p in self.pair_array(np.asarray(pos, dtype=float).reshape(-1, 2),
+                                                   np.asarray(size, dtype=float)).tolist()]
+
+    def pair_array(self, pos, size):
+        n = len(pos)
+        if n < 2:
+            return np.zeros((0, 2), dtype=np.intp)
+        r = size / 2
+        c = pos + r[:, None]
+        cell = size.max()
+        g = np.floor((c - c.min(axis=0)) / cell).astype(np.int64)
+        # Row length with room for the neighbour offsets, so keys never wrap
+        rows = int(g[:, 1].max()) + 3
+        key = g[:, 0] * rows + g[:, 1] + 1
+        order = np.argsort(key, kind='stable')
+        sk = key[order]
+
+        # Same cell: every particle with the ones after it in its run
+        end = np.searchsorted(sk, sk, 'right')
+        a, b = expand(np.arange(n), np.arange(1, n + 1), end)
+        pa, pb = [order[a]], [order[b]]
+        for dx, dy in self.neighbours:
+            k = sk + dx * rows + dy
+            a, b = expand(np.arange(n), np.searchsorted(sk, k, 'left'), np.searchsorted(sk, k, 'right'))
+            pa += [order[a]]
+            pb += [order[b]]
+        i = np.concatenate(pa)
+        j = np.concatenate(pb)
+
+        # Keep the pairs whose bounding squares overlap
+        reach = r[i] + r[j]
+        ok = (np.abs(c[i, 0] - c[j, 0]) <= reach) & (np.abs(c[i, 1] - c[j, 1]) <= reach)
+        i, j = i[ok], j[ok]
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        s = np.argsort(i * n + j)
+        return np.stack([i[s], j[s]], axis=1)
+
+
+def expand(a, lo, hi):
+    # Every (a[k], x) for x in lo[k]:hi[k], as two index arrays
+    k = np.maximum(hi - lo, 0)
+    first = np.repeat(a, k)
+    second = np.arange(k.sum()) - np.repeat(np.cumsum(k) - k - lo, k)
+    return first, second
+
+
+# In the order the 'b' key cycles through them, the first is the default
+BROADPHASES = (SortedGrid, SpatialHash, SweepAndPrune, QuadTree, BruteForce)
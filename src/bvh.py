@@ -0,0 +1,62 @@
+import math as m
+
+
+class EdgeTree:
+    # Static AABB tree over the edges of all polygons. Polygons never move once
+    # built, so the tree only has to be rebuilt when one is added.
+
+    leaf_size = 4
+
+    def __init__(self, polygons):
+        leaves = []
+        for k, t in enumerate(polygons):
+            n = len(t.vertex)
+            for i in range(n):
+                (x0, y0), (x1, y1) = t.vertex[i], t.vertex[(i + 1) % n]
+                leaves += [(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1), k, i)]
+        self.polygons = tuple(polygons)
+        self.root = self.build(leaves) if leaves else None
+
+    def build(self, leaves):
+        # Nodes are [x0, y0, x1, y1, leaves, children]
+        x0 = min(b[0] for b in leaves)
+        y0 = min(b[1] for b in leaves)
+        x1 = max(b[2] for b in leaves)
+        y1 = max(b[3] for b in leaves)
+        if len(leaves) <= self.leaf_size:
+            return [x0, y0, x1, y1, leaves, None]
+
+        # Median split of the box centres along the longest axis
+        a = 0 if x1 - x0 >= y1 - y0 else 1
+        leaves = sorted(leaves, key=lambda b: b[a] + b[a + 2])
+        h = len(leaves) // 2
+        return [x0, y0, x1, y1, None, [self.build(leaves[:h]), self.build(leaves[h:])]]
+
+    def query(self, p):
+        # Returns [(polygon, [edge, ...]), ...] for the edges near particle p
+        if self.root is None:
+            return []
+
+        pw, ph = p.size
+        cx, cy = p.pos[0] + pw / 2, p.pos[1] + ph / 2
+        # Polygon.check_collision hits anything within a pw / 2 wide band around an
+        # edge, which can reach pw / 2 * sqrt(2) past the edge's box at its ends
+        e = pw / 2 * m.sqrt(2)
+        qx0, qy0, qx1, qy1 = cx - e, cy - e, cx + e, cy + e
+
+        found = {}
+        stack = [self.root]
+        while stack:
+            x0, y0, x1, y1, leaves, children = stack.pop()
+            if x0 > qx1 or x1 < qx0 or y0 > qy1 or y1 < qy0:
+                continue
+            if children:
+                stack += children
+                continue
+            for x0, y0, x1, y1, k, i in leaves:
+                if x0 <= qx1 and x1 >= qx0 and y0 <= qy1 and y1 >= qy0:
+                    if k in found:
+                        found[k].append(i)
+                    else:
+                        found[k] = [i]
+        return [(self.polygons[k], sorted(found[k])) for k in sorted(found)]
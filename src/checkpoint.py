@@ -0,0 +1,119 @@
+'''
+Scene checkpoints
+=================
+
+save writes a World's particles, polygons, box size and physics settings to a
+binary file, and load puts them back into any World, whatever its backend:
+
+    checkpoint.save(world, 'scene.pbs')
+    checkpoint.load('scene.pbs', world)
+
+Particle fields are stored as whole arrays, so saving and loading are a few
+bulk reads and writes however many particles there are. File layout, little
+endian: a 128 byte header, then
+
+    pos      float64   (particles, 2)
+    vel      float64   (particles, 2)
+    mass     float64   (particles,)
+    size     float64   (particles,)
+    color    float64   (particles, 3)
+    edges    int64     (polygons,)      vertices of each polygon
+    vertex   float64   (vertices, 2)    every polygon's vertices in turn
+    normal   float64   (vertices, 2)    outward normal of the edge from each vertex
+    colors   float64   (polygons, 3)
+
+The normals are there for other readers of the file. Loading builds each
+Polygon from its vertices again, which is cheap for the handful a scene has and
+keeps the rest of what collisions use consistent with them.
+'''
+
+import struct
+
+import numpy as np
+
+from physics import Polygon
+
+
+MAGIC = b'PBSCENE\0'
+VERSION = 1
+# magic, version, flags, particles, polygons, vertices, w, h, speed, size,
+# inelasticity, e_loss
+HEADER = struct.Struct('<8sIIqqqdddddd')
+HEADER_SIZE = 128
+GRAVITY = 1
+
+PARTICLE_FIELDS = (('pos', (2,)), ('vel', (2,)), ('mass', ()), ('size', ()), ('color', (3,)))
+
+
+def write(f, a, dtype='<f8'):
+    f.write(np.ascontiguousarray(a, dtype).data)
+
+
+def read(f, shape, dtype='<f8'):
+    dtype = np.dtype(dtype)
+    n = int(np.prod(shape)) * dtype.itemsize
+    b = f.read(n)
+    if len(b) != n:
+        raise ValueError('%s is cut off' % f.name)
+    return np.frombuffer(b, dtype).reshape(shape)
+
+
+def save(world, path):
+    st = world.particles
+    polygons = world.polygons
+    edges = [len(t.vertex) for t in polygons]
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, GRAVITY if world.grav else 0, len(st), len(polygons), sum(edges),
+                            world.w, world.h, world.speed, world.size, world.inelasticity,
+                            world.e_loss).ljust(HEADER_SIZE, b'\0'))
+        for k, shape in PARTICLE_FIELDS:
+            write(f, getattr(st, k))
+        write(f, edges, '<i8')
+        write(f, np.reshape([p for t in polygons for p in t.vertex], (-1, 2)))
+        write(f, np.reshape([n for t in polygons for n in t.normal], (-1, 2)))
+        write(f, np.reshape([t.color for t in polygons], (-1, 3)))
+
+
+def read_header(f):
+    b = f.read(HEADER_SIZE)
+    if len(b) < HEADER_SIZE:
+        raise ValueError('%s is not a scene' % f.name)
+    magic, version, flags, n, polygons, vertices, w, h, speed, size, inelasticity, e_loss = HEADER.unpack_from(b)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('%s is not a version %d scene' % (f.name, VERSION))
+    return {'grav': bool(flags & GRAVITY), 'particles': n, 'polygons': polygons, 'vertices': vertices, 'w': w, 'h': h,
+            'speed': speed, 'size': size, 'inelasticity': inelasticity, 'e_loss': e_loss}
+
+
+def read_polygons(f, head):
+    edges = read(f, head['polygons'], '<i8').tolist()
+    vertex = read(f, (head['vertices'], 2)).tolist()
+    read(f, (head['vertices'], 2))
+    colors = read(f, (head['polygons'], 3)).tolist()
+    polygons = []
+    i = 0
+    for k, (e, color) in enumerate(zip(edges, colors)):
+        t = Polygon([tuple(p) for p in vertex[i:i + e]], k)
+        t.color = color
+        polygons += [t]
+        i += e
+    return polygons
+
+
+def load(path, world):
+    # The whole file is read before world is touched, so a cut off or bad file
+    # raises with world as it was
+    with open(path, 'rb') as f:
+        head = read_header(f)
+        n = head['particles']
+        fields = [(k, read(f, (n,) + shape)) for k, shape in PARTICLE_FIELDS]
+        polygons = read_polygons(f, head)
+    st = world.particles
+    st.resize(n)
+    for k, a in fields:
+        np.copyto(getattr(st, k), a)
+    st.hover[:] = False
+    world.polygons = polygons
+    for k in ('w', 'h', 'speed', 'size', 'inelasticity', 'e_loss', 'grav'):
+        setattr(world, k, head[k])
+    return world
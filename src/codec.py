@@ -0,0 +1,182 @@
+'''
+Compressed trajectories
+=======================
+
+A lossy, seekable trajectory format for long recordings. Positions are
+quantized to 2**bits steps across the box (16 bits on an 800 pixel box keeps
+them to 0.012 pixels), every keyframe-th frame is stored whole and the frames
+between store their difference from the last keyframe. Each frame is then
+byte shuffled and packed with zlib, which is fast and always available.
+
+    python codec.py run.traj run.ptz --bits 16 --keyframe 60
+
+converts a Recorder file. Reading a frame only decodes it and its keyframe:
+
+    r = CompressedReader('run.ptz')
+    step, pos = r[1000]
+
+File layout, little endian: a 64 byte header, the frames, the frame index
+(offset, length and keyframe of every frame, int64) and a footer with the
+frame count and the index offset. Frames are a 16 byte head (step int64,
+n int32, keyframe flag int32) and the zlib data.
+'''
+
+import struct
+import zlib
+import argparse
+
+import numpy as np
+
+from trajectory import Recording
+
+
+MAGIC = b'PBTRAJZ\0'
+VERSION = 1
+# magic, version, bits, keyframe interval, w, h, rate
+HEADER = struct.Struct('<8sIIqddd')
+HEADER_SIZE = 64
+FRAME = struct.Struct('<qii')
+FOOTER = struct.Struct('<qq')
+# Values are zigzagged into 32 bits, and 24 bit positions leave room for
+# particles well outside the box and for the differences between frames
+MAX_BITS = 24
+LIMIT = 1 << 31
+
+
+def shuffle(q):
+    # Zigzag makes small negative numbers small positive ones, and grouping the
+    # bytes of every value by significance leaves long runs of zero high bytes
+    q = q.astype('<i4')
+    z = ((q << 1) ^ (q >> 31)).view('<u4')
+    return z.view(np.uint8).reshape(-1, 4).T.tobytes()
+
+
+def unshuffle(b, n):
+    z = np.frombuffer(b, np.uint8).reshape(4, n * 2).T.copy().view('<u4').reshape(n, 2).astype(np.int64)
+    return (z >> 1) ^ -(z & 1)
+
+
+class Quantizer:
+    def __init__(self, w, h, bits=16):
+        if w <= 0 or h <= 0:
+            raise ValueError('a %g x %g box cannot be quantized' % (w, h))
+        if not 1 <= bits <= MAX_BITS:
+            raise ValueError('bits has to be from 1 to %d, not %d' % (MAX_BITS, bits))
+        self.bits = bits
+        self.scale = np.array([(1 << bits) / w, (1 << bits) / h])
+
+    def quantize(self, pos):
+        return np.rint(pos * self.scale).astype(np.int64)
+
+    def restore(self, q):
+        return q / self.scale
+
+
+class CompressedWriter:
+    def __init__(self, path, w, h, bits=16, keyframe=60, rate=60, level=1):
+        self.q = Quantizer(w, h, bits)
+        self.w, self.h = w, h
+        self.keyframe = keyframe
+        self.level = level
+        self.key = None
+        self.since_key = 0
+        # (offset, length, keyframe frame) per frame
+        self.index = []
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, bits, keyframe, w, h, rate).ljust(HEADER_SIZE, b'\0'))
+
+    def encode(self, pos):
+        # (keyframe?, zlib data) for the next frame
+        q = self.q.quantize(pos)
+        # A frame whose particle count changed cannot be a difference
+        key = self.key is None or self.since_key == self.keyframe or len(q) != len(self.key)
+        if key:
+            self.key = q
+            self.since_key = 0
+            d = q
+        else:
+            d = q - self.key
+        # Checked, as shuffle would wrap anything beyond 32 bits without a word
+        if len(d) and not (-LIMIT <= d.min() and d.max() < LIMIT):
+            raise ValueError('positions too far outside the %g x %g box for %d bits' % (
+                self.w, self.h, self.q.bits))
+        self.since_key += 1
+        return key, zlib.compress(shuffle(d), self.level)
+
+    def append(self, step, pos):
+        key, data = self.encode(pos)
+        offset = self.file.tell()
+        self.file.write(FRAME.pack(step, len(pos), key))
+        self.file.write(data)
+        k = len(self.index) if key else self.index[-1][2]
+        self.index.append((offset, FRAME.size + len(data), k))
+
+    def close(self):
+        offset = self.file.tell()
+        self.file.write(np.array(self.index, dtype='<i8').reshape(-1, 3).tobytes())
+        self.file.write(FOOTER.pack(len(self.index), offset))
+        self.file.close()
+
+
+class CompressedReader:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        magic, version, bits, self.keyframe, self.w, self.h, self.rate = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d compressed trajectory' % (path, VERSION))
+        self.q = Quantizer(self.w, self.h, bits)
+        self.file.seek(-FOOTER.size, 2)
+        frames, offset = FOOTER.unpack(self.file.read(FOOTER.size))
+        self.file.seek(offset)
+        self.index = np.frombuffer(self.file.read(frames * 24), '<i8').reshape(frames, 3)
+        # The last keyframe read, as it is usually needed again for the next frame
+        self.cached = (-1, None)
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, i):
+        offset, length, k = self.index[i].tolist()
+        self.file.seek(offset)
+        b = self.file.read(length)
+        step, n, key = FRAME.unpack_from(b)
+        return step, unshuffle(zlib.decompress(b[FRAME.size:]), n), k
+
+    def __getitem__(self, i):
+        # (step, positions) of frame i
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        step, d, k = self.read(i % len(self))
+        if k != i % len(self):
+            if self.cached[0] != k:
+                self.cached = (k, self.read(k)[1])
+            d = d + self.cached[1]
+        return step, self.q.restore(d)
+
+    def close(self):
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('src', help='trajectory file written by Recorder')
+    parser.add_argument('dst')
+    parser.add_argument('--bits', type=int, default=16)
+    parser.add_argument('--keyframe', type=int, default=60)
+    args = parser.parse_args()
+
+    rec = Recording(args.src)
+    out = CompressedWriter(args.dst, rec.w, rec.h, args.bits, args.keyframe, rec.rate)
+    raw = 0
+    for i in range(len(rec)):
+        step, t, pos, vel = rec[i]
+        out.append(step, pos)
+        raw += pos.nbytes
+    size = out.file.tell()
+    out.close()
+    rec.close()
+    print('%d frames, %d bytes of positions in %d, %.1fx' % (len(out.index), raw, size, raw / max(size, 1)))
+
+
+if __name__ == '__main__':
+    main()
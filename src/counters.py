@@ -0,0 +1,41 @@
+# Work counters for tuning: how many pair and polygon edge tests a step makes,
+# how many hit, and how many canvas instructions a frame draws. Physics counting
+# is off unless enable() is called; until then counts is None and every counting
+# site costs one module attribute lookup. The physics counts travel to the UI in
+# each Snapshot, which counts instructions itself.
+
+PHYSICS_COUNTERS = ('pair_tests', 'pair_hits', 'edge_tests', 'polygon_hits')
+RENDER_COUNTERS = ('instructions',)
+COUNTERS = PHYSICS_COUNTERS + RENDER_COUNTERS
+
+counts = None
+
+
+def enable():
+    global counts
+    counts = dict.fromkeys(PHYSICS_COUNTERS, 0)
+
+
+def disable():
+    global counts
+    counts = None
+
+
+def take():
+    # The counts since the last take, reset to zero, or None when disabled
+    global counts
+    if counts is None:
+        return None
+    out = counts
+    counts = dict.fromkeys(PHYSICS_COUNTERS, 0)
+    return out
+
+
+def instructions(group):
+    # Instructions in a canvas or group, counting those inside nested groups
+    n = 0
+    for k in group.children:
+        n += 1
+        if hasattr(k, 'children'):
+            n += instructions(k)
+    return n
@@ -0,0 +1,229 @@
+'''
+Domain decomposition
+====================
+
+ParallelWorld is a World whose step is split across worker processes. The box
+is cut into vertical strips, one per worker, and a particle belongs to the
+strip its centre is in. The particles live in a SharedStore that every worker
+maps, so a worker reads its neighbours' boundary particles (its halo) straight
+from shared memory instead of having them sent.
+
+Each step a worker copies its own particles and its halo into a local World,
+steps it with the usual World.step and writes back only the particles it owns.
+Every part of a step only depends on a particle and the particles touching it
+before the step, and the halo is wide enough to hold all of those, so the
+result is the same as stepping one World. Ownership is worked out again from
+the positions at the start of every step, which is how particles that crossed
+a strip boundary migrate to their new worker.
+'''
+
+import os
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from store import ParticleStore
+from world import World
+import counters
+
+
+class SharedStore(ParticleStore):
+    # ParticleStore in one shared memory block. Growing moves it to a new block,
+    # so anyone attached by name has to attach again. next_pos and next_vel are
+    # where workers write the state after a step.
+
+    fields = ParticleStore.fields + (('next_pos', (2,), float),
+                                     ('next_vel', (2,), float))
+
+    def __init__(self, capacity=1024, name=None):
+        self.n = 0
+        self.capacity = 0
+        self.shm = None
+        if name is None:
+            self.grow(capacity)
+        else:
+            self.map(shared_memory.SharedMemory(name), capacity)
+
+    @classmethod
+    def nbytes(cls, capacity):
+        # Every field starts 8 byte aligned
+        return sum((capacity * int(np.prod(shape)) * np.dtype(dtype).itemsize + 7) // 8 * 8
+                   for k, shape, dtype in cls.fields)
+
+    def map(self, shm, capacity):
+        old = self.shm
+        offset = 0
+        for k, shape, dtype in self.fields:
+            a = np.ndarray((capacity,) + shape, dtype, shm.buf, offset)
+            if self.capacity:
+                a[:self.n] = getattr(self, '_' + k)[:self.n]
+            setattr(self, '_' + k, a)
+            offset += (a.nbytes + 7) // 8 * 8
+        self.shm = shm
+        self.capacity = capacity
+        self.views()
+        return old
+
+    def grow(self, capacity):
+        old = self.map(shared_memory.SharedMemory(create=True, size=self.nbytes(capacity)), capacity)
+        if old is not None:
+            close(old)
+            old.unlink()
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        close(self.shm)
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def close(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # Something still holds a view of the block, it is freed with it
+        pass
+
+
+def start(process):
+    # A spawned process imports the main module again, and with it Kivy when
+    # that is ParticleBox. KIVY_DOC is Kivy's import-only mode, so no second
+    # window is opened there.
+    os.environ['KIVY_DOC'] = '1'
+    try:
+        process.start()
+    finally:
+        del os.environ['KIVY_DOC']
+
+
+def owners(st, w, parts):
+    c = st.pos[:, 0] + st.size / 2
+    if w <= 0:
+        return np.zeros(len(c), dtype=np.intp)
+    return np.clip(np.floor(c * parts / w), 0, parts - 1).astype(np.intp)
+
+
+def step_strip(world, st, k, parts, drag, h):
+    # Steps strip k of parts with world, whose own store is used as scratch
+    w = world.w
+    owner = owners(st, w, parts)
+    # Colliding centres are at most one diameter apart
+    margin = st.size.max()
+    c = st.pos[:, 0] + st.size / 2
+    lo = k * w / parts - margin if k else -np.inf
+    hi = (k + 1) * w / parts + margin if k < parts - 1 else np.inf
+    idx = np.flatnonzero((owner == k) | ((c >= lo) & (c < hi)))
+    mine = owner[idx] == k
+
+    local = world.particles
+    local.resize(len(idx))
+    for f in ('pos', 'vel', 'mass', 'size'):
+        np.take(getattr(st, f), idx, axis=0, out=getattr(local, f))
+
+    if drag is not None and not isinstance(drag[0], slice):
+        j = np.searchsorted(idx, drag[0])
+        drag = (int(j), drag[1]) if j < len(idx) and idx[j] == drag[0] else None
+    world.reset_phases()
+    world.step(drag, h)
+
+    st.next_pos[idx[mine]] = local.pos[mine]
+    st.next_vel[idx[mine]] = local.vel[mine]
+    return int(mine.sum()), len(idx) - int(mine.sum()), world.phases, counters.take()
+
+
+def run_worker(conn, k, parts):
+    world = World(0, 0)
+    st = None
+    while True:
+        cmd, *args = conn.recv()
+        if cmd == 'attach':
+            if st is not None:
+                st.close()
+            st = SharedStore(args[1], args[0])
+        elif cmd == 'polygons':
+            world.polygons = []
+            for pts in args[0]:
+                world.add_polygon(pts)
+        elif cmd == 'step':
+            n, drag, h, (world.w, world.h, world.e_loss, world.grav, world.inelasticity, bp), counting = args
+            if counting != (counters.counts is not None):
+                counters.enable() if counting else counters.disable()
+            if type(world.broadphase) is not bp:
+                world.broadphase = bp()
+            st.resize(n)
+            conn.send(step_strip(world, st, k, parts, drag, h) if n else (0, 0, {}, counters.take()))
+        elif cmd == 'stop':
+            if st is not None:
+                st.close()
+            return
+
+
+class ParallelWorld(World):
+    def __init__(self, w, h, workers=None, seed=None):
+        super().__init__(w, h, seed)
+        self.particles = SharedStore()
+        self.workers = workers or os.cpu_count()
+        # Particles owned by and in the halo of each worker, and particles that
+        # changed strip, during the last step
+        self.owned = [0] * self.workers
+        self.halo = [0] * self.workers
+        self.migrated = 0
+        self.attached = None
+        self.sent_polygons = None
+
+        ctx = mp.get_context('spawn')
+        self.conns = []
+        self.processes = []
+        for k in range(self.workers):
+            a, b = ctx.Pipe()
+            p = ctx.Process(target=run_worker, args=(b, k, self.workers), daemon=True)
+            start(p)
+            self.conns += [a]
+            self.processes += [p]
+
+    def send(self, *msg):
+        for c in self.conns:
+            c.send(msg)
+
+    def step(self, drag=None, h=1):
+        st = self.particles
+        if st.name != self.attached:
+            self.attached = st.name
+            self.send('attach', st.name, st.capacity)
+        # Polygons are compared by identity, as loading a scene replaces them
+        # with as many new ones
+        if self.sent_polygons != tuple(self.polygons):
+            self.sent_polygons = tuple(self.polygons)
+            self.send('polygons', [t.vertex for t in self.polygons])
+
+        before = owners(st, self.w, self.workers)
+        self.send('step', len(st), drag, h,
+                  (self.w, self.h, self.e_loss, self.grav, self.inelasticity, type(self.broadphase)),
+                  counters.counts is not None)
+        self.owned, self.halo, phases, counts = [list(k) for k in zip(*[c.recv() for c in self.conns])]
+        # Workers run side by side, so the slowest one is what a phase costs,
+        # while the work they count (halos included) adds up
+        for k in self.phases:
+            self.phases[k] += max(ph.get(k, 0) for ph in phases)
+        if counters.counts is not None:
+            for c in counts:
+                for k in c or ():
+                    counters.counts[k] += c[k]
+        t = time.perf_counter()
+        np.copyto(st.pos, st.next_pos)
+        np.copyto(st.vel, st.next_vel)
+        self.migrated = int((owners(st, self.w, self.workers) != before).sum())
+        self.phases['integrate'] += time.perf_counter() - t
+
+    def close(self):
+        self.send('stop')
+        for p in self.processes:
+            p.join(1)
+        self.particles.close()
+        self.particles.unlink()
@@ -0,0 +1,221 @@
+import numpy as np
+
+import counters
+from physics import SQRT2
+
+
+def pair_array(pairs):
+    # Sorted (k, 2) index array, so the result never depends on the order a
+    # broad phase happens to emit its pairs in. Arrays from a broad phase's
+    # pair_array are sorted already.
+    if isinstance(pairs, np.ndarray):
+        return pairs
+    p = np.asarray(pairs, dtype=np.intp).reshape(-1, 2)
+    return p[np.lexsort((p[:, 1], p[:, 0]))]
+
+
+def scatter(idx, values, n):
+    # Sums per pair rows into per particle rows. bincount adds in pair order, so
+    # a particle that is in several pairs always gets the same total.
+    return np.stack([np.bincount(idx, values[:, k], minlength=n) for k in range(values.shape[1])], axis=1)
+
+
+def collide_pairs(st, pairs, e_loss=1):
+    # Batch version of World.p_collision for every candidate pair at once.
+    # Velocities and corrections are computed from the state before the tick and
+    # averaged per particle, instead of being applied one pair after another.
+    # The push apart is along the line between the centres, where p_collision
+    # pushes along the angle between the two corners at pos, so the two only
+    # agree for particles of equal size.
+    p = pair_array(pairs)
+    counts = counters.counts
+    if counts is not None:
+        counts['pair_tests'] += len(p)
+    if not len(p):
+        return 0
+    i, j = p[:, 0], p[:, 1]
+
+    r = st.size / 2
+    c = st.pos + r[:, None]
+    d = c[i] - c[j]
+    dist = np.hypot(d[:, 0], d[:, 1])
+    hit = dist <= r[i] + r[j]
+    if not hit.any():
+        return 0
+    i, j, d, dist = i[hit], j[hit], d[hit], dist[hit]
+    if counts is not None:
+        counts['pair_hits'] += len(i)
+
+    m1 = st.mass[i][:, None]
+    m2 = st.mass[j][:, None]
+    v1 = st.vel[i]
+    v2 = st.vel[j]
+    n = len(st)
+    dv = scatter(i, m2 / m1 * v2 * e_loss - v1, n) + scatter(j, m1 / m2 * v1 * e_loss - v2, n)
+
+    # Push both apart along the line between the centres by half the overlap,
+    # plus the same one pixel nudge p_collision uses to split coincident particles
+    normal = np.divide(d, dist[:, None], out=np.zeros_like(d), where=dist[:, None] > 0)
+    s = ((r[i] + r[j] - dist) / 2)[:, None] * normal + 1
+    dp = scatter(i, s, n) - scatter(j, s, n)
+
+    # A particle in k pairs gets the mean of its k results. Summing them instead
+    # lets velocities grow without bound in dense piles.
+    k = np.maximum(np.bincount(i, minlength=n) + np.bincount(j, minlength=n), 1)[:, None]
+    st.vel += dv / k
+    st.pos += dp / k
+    return len(i)
+
+
+class PolygonTable:
+    # Every polygon's edge geometry in arrays padded to the most edges any
+    # polygon has, so all particle and polygon candidates can be tested at once.
+    # Polygons never move, so a table only has to be built when they change.
+    # Padding edges have a bisector band of -inf and never hit.
+
+    def __init__(self, polygons):
+        self.polygons = tuple(polygons)
+        p = len(polygons)
+        e = max([len(t.vertex) for t in polygons] + [1])
+        self.edges = np.array([len(t.vertex) for t in polygons], dtype=np.intp)
+        self.line = np.zeros((p, e, 3))
+        self.bisector = np.zeros((p, e, 3))
+        self.half = np.full((p, e), -np.inf)
+        for k, t in enumerate(polygons):
+            n = len(t.vertex)
+            self.line[k, :n] = t.line
+            self.bisector[k, :n] = t.bisector
+            self.half[k, :n] = t.half
+        self.normal = self.line[:, :, :2]
+        # Index of the edge after each one, wrapping within each polygon
+        self.next = (np.arange(e) + 1) % np.maximum(self.edges, 1)[:, None]
+        self.box = np.array([t.box for t in polygons], dtype=float).reshape(p, 4)
+
+
+def polygon_candidates(table, pos, size, idx=None, slack=0):
+    # (particle, polygon) index arrays for every particle whose centre is near a
+    # polygon's box, sorted by particle and then polygon, for the particles in
+    # idx or all of them. Particles are sorted by x once, so each polygon only
+    # looks at the run of particles under its box. Near is within reach of the
+    # largest particle plus slack; polygon_hits tests each particle's own reach.
+    if idx is not None:
+        pos, size = pos[idx], size[idx]
+    if not len(table.box) or not len(pos):
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    r = size / 2
+    c = pos + r[:, None]
+    reach = r.max() * SQRT2 + slack
+    order = np.argsort(c[:, 0], kind='stable')
+    cx = c[order, 0]
+    lo = np.searchsorted(cx, table.box[:, 0] - reach, 'left')
+    hi = np.searchsorted(cx, table.box[:, 2] + reach, 'right')
+    k = hi - lo
+    t = np.repeat(np.arange(len(k)), k)
+    i = order[np.arange(k.sum()) - np.repeat(np.cumsum(k) - k - lo, k)]
+    b = table.box[t]
+    y = c[i, 1]
+    ok = (y >= b[:, 1] - reach) & (y <= b[:, 3] + reach)
+    i, t = i[ok], t[ok]
+    if idx is not None:
+        i = idx[i]
+    s = np.lexsort((t, i))
+    return i[s], t[s]
+
+
+def polygon_hits(table, pos, size, vel, i, t):
+    # Polygon.check_collision for particle i[k] against polygon t[k], for every
+    # k at once. Returns the k that hit, the edge each one hit and the push out
+    # depth.
+    r = size[i] / 2
+    c = pos[i] + r[:, None]
+    e = r * SQRT2
+    b = table.box[t]
+    near = np.flatnonzero((c[:, 0] >= b[:, 0] - e) & (c[:, 0] <= b[:, 2] + e) &
+                          (c[:, 1] >= b[:, 1] - e) & (c[:, 1] <= b[:, 3] + e))
+    r = r[near]
+    c = c[near]
+    t = t[near]
+
+    counts = counters.counts
+    if counts is not None:
+        counts['edge_tests'] += int(table.edges[t].sum())
+
+    line = table.line[t]
+    bisector = table.bisector[t]
+    # Distance from each edge's line and from its perpendicular bisector, (pairs, edges)
+    d = np.abs(c[:, :1] * line[:, :, 0] + c[:, 1:] * line[:, :, 1] + line[:, :, 2])
+    l = np.abs(c[:, :1] * bisector[:, :, 0] + c[:, 1:] * bisector[:, :, 1] + bisector[:, :, 2])
+    hit = (d <= r[:, None]) & (l <= table.half[t] + r[:, None])
+
+    s = hit.sum(axis=1)
+    one = np.flatnonzero(s == 1)
+    edge_one = hit[one].argmax(axis=1)
+    depth_one = r[one] - d[one, edge_one] + 1
+
+    # Several edges hit: the first pair of neighbouring edges that are both hit
+    # decides, and the one the particle moves into the most wins
+    many = np.flatnonzero(s > 1)
+    after = table.next[t[many]]
+    both = hit[many] & np.take_along_axis(hit[many], after, axis=1)
+    ok = both.any(axis=1)
+    many = many[ok]
+    a = both[ok].argmax(axis=1)
+    b = after[ok, a]
+    v = vel[i[near[many]]]
+    va = (table.normal[t[many], a] * v).sum(axis=1)
+    vb = (table.normal[t[many], b] * v).sum(axis=1)
+    edge_many = np.where(va < vb, a, b)
+
+    k = near[np.concatenate([one, many])]
+    edge = np.concatenate([edge_one, edge_many])
+    depth = np.concatenate([depth_one, np.ones(len(many))])
+    return k, edge, depth
+
+
+def collide_polygons(st, table, e_loss=1):
+    # Reflects every particle that hits a polygon about the hit edge's normal,
+    # like World.t_collision does for one particle and polygon. A particle near
+    # several polygons meets them in order, one per round, each round seeing
+    # where the last one left it, as the per particle loop does. Candidates are
+    # found with slack for one push out, and a particle pushed further than
+    # that from where its candidates were found looks for them again.
+    n = len(st)
+    slack = st.size.max() / 2 + 1 if n else 0
+    i, t = polygon_candidates(table, st.pos, st.size, slack=slack)
+    origin = st.pos.copy()
+    # Particle p's candidates left to test are t[head[p]:end[p]]
+    c = np.bincount(i, minlength=n)
+    end = np.cumsum(c)
+    head = end - c
+    active = np.flatnonzero(c)
+    hits = 0
+    while len(active):
+        pi, pt = active, t[head[active]]
+        rows, edge, depth = polygon_hits(table, st.pos, st.size, st.vel, pi, pt)
+        idx = pi[rows]
+        normal = table.normal[pt[rows], edge]
+        v = st.vel[idx]
+        n_dot_v = (normal * v).sum(axis=1)[:, None]
+        st.vel[idx] = (v - 2 * normal * n_dot_v) * e_loss
+        st.pos[idx] += normal * depth[:, None]
+        hits += len(idx)
+        head[active] += 1
+
+        far = np.sort(idx[np.abs(st.pos[idx] - origin[idx]).max(axis=1) > slack])
+        if len(far):
+            last = np.full(n, -1)
+            last[idx] = pt[rows]
+            origin[far] = st.pos[far]
+            fi, ft = polygon_candidates(table, st.pos, st.size, far, slack)
+            ok = ft > last[fi]
+            c = np.bincount(fi[ok], minlength=n)
+            e = len(t) + np.cumsum(c)
+            head[far] = (e - c)[far]
+            end[far] = e[far]
+            t = np.concatenate([t, ft[ok]])
+        active = active[head[active] < end[active]]
+
+    counts = counters.counts
+    if counts is not None:
+        counts['polygon_hits'] += hits
+    return hits
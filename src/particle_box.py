@@ -6,243 +6,123 @@ from kivy.uix.label import Label
 from kivy.clock import Clock
 from kivy.uix.boxlayout import BoxLayout
 from kivy.app import App
-from kivy.graphics import Color, Ellipse, Rectangle, Mesh, Line
 from kivy.core.window import Window
 
-import threading
+import os
+import csv
+import json
+import time
+import argparse
 from functools import partial
-from random import random as rnd
-import math as m
-
-
-class Particle:
-    def __init__(self, x, y, speed, size, id, w, h):
-        self.color = [x / w, y / w, 1]
-        self.pos = [x, y]
-        self.vel = [(2 * rnd() - 1) * speed, (2 * rnd() - 1) * speed]
-        self.mass = size * (rnd() + 1)
-        self.size = (self.mass, self.mass)
-        self.id = id
-        self.hover = False
-
-    def check_collision(self, p):
-        x1, y1 = self.pos
-        w1, h1 = self.size
-        x2, y2 = p.pos
-        w2, h2 = p.size
-
-        if (x1 - x2 + (w1 - w2) / 2)**2 + (y1 - y2 + (h1 - h2) / 2)**2 <= (w1 + w2)**2 / 4:
-            return True
-        return False
-
-
-class Polygon:
-    def __init__(self, pts, id):
-        self.color = [rnd(), rnd(), 1]
-        self.vertex = pts[:]
-        self.normal = []
-
-        area = 0
-        for i in range(len(pts)):
-            j = (i + 1) % len(pts)
-            area += (pts[j][0] - pts[i][0]) * (pts[j][1] + pts[i][1])
-        direct = 1
-        if area > 0:
-            direct = -1
-
-        for i in range(len(pts)):
-            j = (i + 1) % len(pts)
-            norm = m.sqrt((pts[i][0] - pts[j][0])**2 + (pts[i][1] - pts[j][1])**2) * direct
-            self.normal += [((pts[j][1] - pts[i][1]) / norm, (pts[i][0] - pts[j][0]) / norm)]
-
-        self.id = id
-
-    def check_collision(self, p):
-        pw, ph = p.size
-        px, py = p.pos[0] + pw / 2, p.pos[1] + ph / 2
-
-        d = []
-        l = []
-        hit = []
-        for i in range(len(self.vertex)):
-            j = (i + 1) % len(self.vertex)
-            x0, y0 = (self.vertex[i][0] + self.vertex[j][0]) / 2, (self.vertex[i][1] + self.vertex[j][1]) / 2
-            if self.normal[i][1] != 0:
-                m_1 = - self.normal[i][0] / self.normal[i][1]
-                b_2 = self.vertex[i][1] - m_1 * self.vertex[i][0]
-                d += [abs(-m_1 * px + py - b_2) / m.sqrt(1 + m_1**2)]
-
-                if m_1 != 0:
-                    m_2 = -1 / m_1
-                    b_2 = y0 - m_2 * x0
-                    l += [abs(-m_2 * px + py - b_2) / m.sqrt(1 + m_2**2)]
-                else:
-                    l += [abs(x0 - px)]
-            else:
-                d += [abs(x0 - px)]
-                l += [abs(y0 - py)]
-
-            w = m.sqrt((self.vertex[i][0] - self.vertex[j][0])**2 + (self.vertex[i][1] - self.vertex[j][1])**2)
-            hit += [0]
-            if d[i] <= pw / 2 and l[i] <= w / 2 + pw / 2:
-                hit[i] = 1
-
-        s = sum(hit)
-        if s == 0:
-            return False
-        for i in range(len(self.vertex)):
-            if s == 1:
-                if hit[i]:
-                    return (i, pw / 2 - d[i] + 1)
-            if s > 1:
-                j = (i + 1) % len(self.vertex)
-                if hit[i] and hit[j]:
-                    if self.normal[i][0]*p.vel[0]+self.normal[i][1]*p.vel[1] < self.normal[j][0]*p.vel[0]+self.normal[j][1]*p.vel[1]:
-                        return (i, 1)
-                    return (j, 1)
+
+from sim import ThreadSim, ProcessSim, CAPACITY
+from broadphase import BROADPHASES
+from backends import BACKENDS, default_backend
+from timers import Timers, Histogram, PHASES, PHYSICS_PHASES, SUMMARY
+import counters
+from counters import COUNTERS, PHYSICS_COUNTERS
+from render import ImmediateRenderer, RetainedRenderer, MeshRenderer
+
+
+def options():
+    # Kivy keeps the arguments after '--' for the app:
+    #   python particle_box.py -- --process --backend parallel
+    parser = argparse.ArgumentParser()
+    # Physics runs in a child process instead of on a thread of this one
+    parser.add_argument('--process', action='store_true', default=os.environ.get('PARTICLE_BOX_PROCESS') == '1')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=default_backend())
+    # Physics updates per second, whatever the frame rate, and World.steps per update
+    parser.add_argument('--rate', type=float, default=60)
+    parser.add_argument('--substeps', type=int, default=1)
+    # Count collision tests and canvas instructions, and write them per frame to a CSV file
+    parser.add_argument('--counters', action='store_true', default=os.environ.get('PARTICLE_BOX_COUNTERS') == '1')
+    parser.add_argument('--counters-log')
+    # Write latency percentiles every few seconds, as JSON or CSV by the file's extension
+    parser.add_argument('--latency-log')
+    # Record every physics update's positions and velocities to a trajectory file
+    parser.add_argument('--record')
+    # Particles each recorded step has room for, any beyond are left out
+    parser.add_argument('--record-capacity', type=int, default=CAPACITY)
+    # Scene file that 's' saves to and 'l' loads, and that is loaded at start when given
+    parser.add_argument('--scene')
+    # Seed for spawn positions, velocities, masses and polygon colours, so runs repeat
+    parser.add_argument('--seed', type=int)
+    return parser.parse_known_args()[0]
+
 
 class ParticleBox(App):
     def draw(self):
-        self.wid.canvas.clear()
-        with self.wid.canvas:
-            for t in self.polygons:
-                p = []
-                indices = []
-                for i in range(len(t.vertex)):
-                    j = (i + 1) % len(t.vertex)
-                    p += [t.vertex[i][0] + self.wid.x, t.vertex[i][1] + self.wid.y, 0, 0]
-                    indices += [i]
-                    if self.show_norms:
-                        Color((1, 1, 1))
-                        Line(points=[(t.vertex[i][0] + t.vertex[j][0]) / 2 + self.wid.x,
-                                       (t.vertex[i][1] + t.vertex[j][1]) / 2 + self.wid.y,
-                                       (t.vertex[i][0] + t.vertex[j][0]) / 2 + t.normal[i][0] * 20 + self.wid.x,
-                                       (t.vertex[i][1] + t.vertex[j][1]) / 2 + t.normal[i][1] * 20 + self.wid.y], width=1)
-                Color(*t.color)
-                Mesh(vertices=p, indices=indices, mode='line_loop')
-
-            for i in self.particles:
-                if i.hover or i.id == self.selected:
-                    Color(1, 1, 1)
-                    Ellipse(pos=(i.pos[0] + self.wid.x - 2, i.pos[1] + self.wid.y - 2), size=(i.size[0] + 4, i.size[1] + 4))
-                Color(*i.color)
-                Ellipse(pos=(i.pos[0] + self.wid.x, i.pos[1] + self.wid.y), size=i.size)
-
-            if self.poly_build:
-                p = []
-                for i in self.poly_points:
-                    p += [i[0] + self.wid.x, i[1] + self.wid.y]
-                Color((1, 1, 1))
-                Line(points=p, width=1)
-                if len(self.poly_points) == 1:
-                    Ellipse(pos=(self.poly_points[0][0] + self.wid.x, self.poly_points[0][1] + self.wid.y), size=(5, 5))
-
-                Ellipse(pos=(self.mouse[0], self.mouse[1]), size=(5, 5))
-
-    def p_collision(self, p1, p2):
-        if p1.check_collision(p2):
-            x1, y1 = p1.pos
-            x2, y2 = p2.pos
-            w1, h1 = p1.size
-            w2, h2 = p2.size
-
-            m1 = p2.mass / p1.mass
-            m2 = p1.mass / p2.mass
-
-            p1.vel, p2.vel = [m1 * p2.vel[0] * self.e_loss,
-                              m1 * p2.vel[1] * self.e_loss], [m2 * p1.vel[0] * self.e_loss,
-                              m2 * p1.vel[1] * self.e_loss]
-
-            if x1 != p2.pos[0]:
-                g = m.atan(abs(y1 - y2) / abs(x1 - x2))
-            else:
-                g = m.pi * (-1, 1)[y1 > y2] / 2
-
-            d = ((h1 + h2) / 2 - m.sqrt((x1 - x2 + (w1 - w2) / 2)**2 + (y1 - y2 + (h1 - h2) / 2)**2)) / 2
-            dx = m.cos(g) * d * (1, -1)[x2 > x1] + 1
-            dy = m.sin(g) * d * (1, -1)[y2 > y1] + 1
-            p1.pos = [p1.pos[0] + dx, p1.pos[1] + dy]
-            p2.pos = [p2.pos[0] - dx, p2.pos[1] - dy]
-
-    def t_collision(self, p, t):
-        v = t.check_collision(p)
-        if v:
-            n = t.normal[v[0]]
-
-            n_dot_v = n[0] * p.vel[0] + n[1] * p.vel[1]
-
-            p.vel[0] = (p.vel[0] - 2 * n[0] * n_dot_v) * self.e_loss
-            p.pos[0] += n[0] * v[1]
-            p.vel[1] = (p.vel[1] - 2 * n[1] * n_dot_v) * self.e_loss
-            p.pos[1] += n[1] * v[1]
-
-    def wall_collision(self, p1):
-        if p1.pos[0] + p1.size[0] > self.w:
-            p1.vel[0] *= -1 * self.e_loss
-            p1.pos[0] -= p1.pos[0] + p1.size[0] - self.w
-        elif p1.pos[0] < 0:
-            p1.vel[0] *= -1 * self.e_loss
-            p1.pos[0] -= p1.pos[0]
-        if p1.pos[1] + p1.size[1] > self.h:
-            p1.vel[1] *= -1 * self.e_loss
-            p1.pos[1] -= p1.pos[1] + p1.size[1] - self.h
-        elif p1.pos[1] < 0:
-            p1.vel[1] *= -1 * self.e_loss
-            p1.pos[1] -= p1.pos[1]
+        snap = self.sim.latest()
+        new = snap.step != self.timed_step
+        if new:
+            self.timed_step = snap.step
+            for k, t in zip(PHYSICS_PHASES, snap.phases.tolist()):
+                self.timers.record(k, t)
+            # Physics keeps the histogram itself, so updates between frames
+            # are counted too
+            self.latency['physics'].load(snap.latency)
+
+        t = time.perf_counter()
+        self.renderer.draw(self, snap, snap.positions())
+        self.timers.record('build', time.perf_counter() - t)
+        self.label1.text = str(snap.n)
+
+        if self.counting:
+            self.count(snap, new)
+
+    def count(self, snap, new):
+        # Physics counts arrive once per snapshot, so frames in between log zeros
+        # for them and the overlay keeps showing the last ones
+        physics = snap.counts.tolist() if new else [0] * len(PHYSICS_COUNTERS)
+        if new:
+            self.counts.update(zip(PHYSICS_COUNTERS, physics))
+        self.counts['instructions'] = counters.instructions(self.renderer.canvas)
+        self.frames += 1
+        if self.counter_log:
+            self.counter_log.writerow([self.frames, snap.step] + physics + [self.counts['instructions']])
+
+    def update_overlay(self, dt):
+        if not self.show_timers:
+            return
+        stats = self.timers.stats()
+        lines = ['%-12s %7s %7s' % ('phase', 'avg ms', 'max ms')]
+        lines += ['%-12s %7.2f %7.2f' % ((k,) + stats[k]) for k in PHASES]
+        lines += ['', '%-12s %7s %7s %7s %7s' % ('latency ms', 'p50', 'p95', 'p99', 'max')]
+        for k, h in self.latency.items():
+            s = h.summary()
+            lines += ['%-12s %7.2f %7.2f %7.2f %7.2f' % (k, s['p50'], s['p95'], s['p99'], s['max'])]
+        if self.counting:
+            lines += [''] + ['%-12s %15d' % (k, self.counts[k]) for k in COUNTERS]
+        self.overlay.text = '\n'.join(lines)
+        self.overlay.texture_update()
+        self.overlay.size = self.overlay.texture_size
+        self.overlay.pos = (self.wid.x + 10, self.wid.top - self.overlay.height - 10)
+
+    def send_pointer(self):
+        # Physics works in box coordinates, the window's are only known here
+        x, y = self.wid.x, self.wid.y
+        self.sim.command('pointer', (self.mouse[0] - x, self.mouse[1] - y),
+                         (self.prev_mouse[0] - x, self.prev_mouse[1] - y), self.ctrl)
 
     def tick(self, dt):
         self.update_window_size()
-
-        for i, p1 in enumerate(self.particles):
-            for p2 in self.particles[i + 1:]:
-                self.p_collision(p1, p2)
-
-            for t in self.polygons:
-                self.t_collision(p1, t)
-
-            mx = self.mouse[0] - self.wid.x
-            my = self.mouse[1] - self.wid.y
-            if m.sqrt((mx - p1.pos[0] - p1.size[0] / 2)**2 + (my - p1.pos[1] - p1.size[1] / 2)**2) < p1.size[0]:
-                 # p1.size[0] / 2 for accuracy
-                p1.hover = True
-                if self.clicked and self.selected == -1:
-                    self.selected = p1.id
-                    self.clicked = False
-            else:
-                p1.hover = False
-
-            if self.selected == p1.id or self.ctrl:
-                p1.vel = [self.mouse[0] - self.prev_mouse[0], self.mouse[1] - self.prev_mouse[1]]
-
-            p1.pos = [p1.pos[0] + p1.vel[0], p1.pos[1] + p1.vel[1]]
-
-            self.wall_collision(p1)
-
-            if self.grav:
-                p1.vel[1] -= 0.2
-                p1.vel[1] *= self.inelasticity
+        self.send_pointer()
 
         self.draw()
 
         if dt:
-            self.label2.text = str(int(1/dt)) + ' FPS'
+            self.timers.record('frame', dt)
+            self.latency['frame'].record(dt)
+            self.label2.text = '%d FPS, max %d ms' % (1 / self.timers.mean('frame'), self.timers.max('frame') * 1000)
 
         self.dt = dt
         Clock.schedule_once(self.tick)
 
     def add(self, n, *largs):
-        self.particles += [Particle(rnd() * self.w, rnd() * self.h, self.speed,
-                           self.size, len(self.particles) + i, self.w, self.h) for i in range(n)]
-        self.label1.text = str(len(self.particles))
+        self.sim.command('add', n)
 
     def sub(self, n, *largs):
-        if not n:
-            n = len(self.particles)
-        if len(self.particles) >= n:
-            self.particles = self.particles[:-n]
-        else:
-            self.particles = []
-        self.label1.text = str(len(self.particles))
+        self.sim.command('sub', n)
 
     def set_mouse_pos(self, p, dt=0):
         self.pos_schedule.cancel()
@@ -256,86 +136,158 @@ class ParticleBox(App):
     def update_window_size(self):
         self.w, self.h = Window.size
         self.h -= 50
+        if (self.w, self.h) != self.box:
+            self.box = (self.w, self.h)
+            self.sim.command('resize', self.w, self.h)
 
     def on_mouse_down(self, *args):
-        self.clicked = True
+        self.send_pointer()
+        self.sim.command('click')
         if self.poly_build:
             if len(self.poly_points):
                 if (self.poly_points[0][0] - self.mouse[0] + self.wid.x)**2 + (
                     self.poly_points[0][1] - self.mouse[1] + self.wid.y)**2 < 100:
                     self.poly_build = False
-                    self.polygons += [Polygon(self.poly_points, len(self.polygons))]
+                    self.sim.command('add_polygon', self.poly_points)
                     self.poly_points = []
                     return
             self.poly_points += [(self.mouse[0] - self.wid.x, self.mouse[1] - self.wid.y)]
 
+    def next_broadphase(self):
+        self.broadphase = (self.broadphase + 1) % len(BROADPHASES)
+        self.sim.command('broadphase', self.broadphase)
+        self.label3.text = BROADPHASES[self.broadphase].name
+
+    def next_renderer(self):
+        self.wid.canvas.remove(self.renderer.canvas)
+        i = (self.renderers.index(self.renderer) + 1) % len(self.renderers)
+        self.renderer = self.renderers[i]
+        self.renderer.reset()
+        self.wid.canvas.add(self.renderer.canvas)
+        self.label4.text = self.renderer.name
+
+    def save_scene(self):
+        self.sim.command('save', self.scene)
+
+    def load_scene(self):
+        if not os.path.exists(self.scene):
+            return
+        self.sim.command('load', self.scene)
+        # The window is the box, whatever size the scene was saved at
+        self.box = (0, 0)
+
     def on_mouse_up(self, *args):
-        for i in self.particles:
-            if i.id == self.selected:
-                i.vel[0] = self.mouse[0] - self.prev_mouse[0]
-                i.vel[1] = self.mouse[1] - self.prev_mouse[1]
-        self.clicked = False
-        self.selected = -1
+        self.send_pointer()
+        self.sim.command('release')
 
     def on_key_down(self, *args):
         if args[1] == 305:
             self.ctrl = True
         if args[1] == 304:
-            self.grav = True
+            self.sim.command('gravity', True)
         if args[1] == 308:
-            self.e_loss = self.inelasticity
+            self.sim.command('inelastic', True)
         if args[1] == 110:
             self.show_norms = True
         if args[1] == 112:
             self.poly_build = not self.poly_build
             self.poly_points = []
+        if args[1] == 98:
+            self.next_broadphase()
+        if args[1] == 114:
+            self.next_renderer()
+        if args[1] == 116:
+            self.show_timers = not self.show_timers
+            self.overlay.opacity = 1 if self.show_timers else 0
+            self.update_overlay(0)
+        if args[1] == 115:
+            self.save_scene()
+        if args[1] == 108:
+            self.load_scene()
 
     def on_key_up(self, *args):
         if args[1] == 305:
             self.ctrl = False
         if args[1] == 304:
-            self.grav = False
+            self.sim.command('gravity', False)
         if args[1] == 308:
-            self.e_loss = 1
+            self.sim.command('inelastic', False)
         if args[1] == 110:
             self.show_norms = False
 
     def build(self):
-        self.clicked = False
-        self.selected = -1
-        self.speed = 3
-        self.size = 20
-        self.inelasticity = 0.95
-        self.grav = False
         self.mouse = (0, 0)
+        self.prev_mouse = (0, 0)
         self.ctrl = False
-        self.e_loss = 1
         self.show_norms = False
         self.poly_build = False
         self.poly_points = []
+        self.box = (0, 0)
+        self.timers = Timers()
+        self.timed_step = -1
+        self.show_timers = False
+        # Every physics update, every frame's drawing (render build and canvas
+        # submit) and every frame's length, for tail latencies
+        self.latency = {k: Histogram() for k in ('physics', 'draw', 'frame')}
+        self.broadphase = 0
+        self.stopped = False
+        opts = options()
+        self.counting = opts.counters or opts.counters_log is not None
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.frames = 0
+        self.counter_log = None
+        if self.counting:
+            counters.enable()
+        if opts.counters_log:
+            self.counter_file = open(opts.counters_log, 'w', newline='')
+            self.counter_log = csv.writer(self.counter_file)
+            self.counter_log.writerow(['frame', 'step'] + list(COUNTERS))
+        self.latency_log = opts.latency_log
+        if self.latency_log:
+            Clock.schedule_interval(self.dump_latency, 5)
+        if opts.process:
+            self.sim = ProcessSim(0, 0, opts.rate, opts.substeps, backend=opts.backend, seed=opts.seed)
+        else:
+            self.sim = ThreadSim(0, 0, opts.rate, opts.substeps, backend=opts.backend, seed=opts.seed)
+        self.scene = opts.scene or 'scene.pbs'
+        self.renderers = [RetainedRenderer(), MeshRenderer(), ImmediateRenderer()]
+        self.renderer = self.renderers[0]
 
         Window.bind(mouse_pos=lambda w, p: self.set_mouse_pos(p))
         Window.bind(on_touch_down=self.on_mouse_down)
         Window.bind(on_touch_up=self.on_mouse_up)
         Window.bind(on_key_down=self.on_key_down)
         Window.bind(on_key_up=self.on_key_up)
+        # Kivy draws every canvas between these two, before swapping buffers
+        Window.bind(on_draw=lambda *args: self.timers.start('submit'))
+        Window.bind(on_flip=self.flipped)
         self.pos_schedule = Clock.schedule_once(self.update_mouse, 0.1)
         self.update_window_size()
 
         # Add static meshes here
-        # self.polygons = [Polygon([(200, 200), (250, 200), (200, 250)], 0),
-        #                  Polygon([(400, 400), (480, 420), (380, 450)], 1),
-        #                  Polygon([(560, 50), (680, 120), (550, 250)], 1),
-        #                  Polygon([(100, 100), (150, 50), (200, 100), (200, 130), (100, 130)], 1)]
-        self.polygons = []
+        # self.sim.command('add_polygon', [(200, 200), (250, 200), (200, 250)])
+        # self.sim.command('add_polygon', [(400, 400), (480, 420), (380, 450)])
+        # self.sim.command('add_polygon', [(560, 50), (680, 120), (550, 250)])
+        # self.sim.command('add_polygon', [(100, 100), (150, 50), (200, 100), (200, 130), (100, 130)])
 
         self.label1 = Label(text='0')
         self.label2 = Label(text='0 FPS')
+        self.label3 = Label(text=BROADPHASES[self.broadphase].name)
+        self.label4 = Label(text=self.renderer.name)
 
-        self.particles = []
-        self.add(100)
+        if opts.scene and os.path.exists(opts.scene):
+            self.load_scene()
+        else:
+            self.add(100)
+        # After the first resize, so the recording knows the size of the box
+        if opts.record:
+            self.sim.command('record', opts.record, opts.record_capacity)
 
         self.wid = Widget(size=(self.w, self.h))
+        self.wid.canvas.add(self.renderer.canvas)
+        self.overlay = Label(font_name='RobotoMono-Regular', font_size=12, opacity=0)
+        self.wid.add_widget(self.overlay)
+        Clock.schedule_interval(self.update_overlay, 0.25)
 
         layout = BoxLayout(size_hint=(1, None), height=50)
         layout.add_widget(Button(text='+ 10', on_press=partial(self.add, 10)))
@@ -344,16 +296,52 @@ class ParticleBox(App):
         layout.add_widget(Button(text='Clear', on_press=partial(self.sub, 0)))
         layout.add_widget(self.label1)
         layout.add_widget(self.label2)
+        layout.add_widget(self.label3)
+        layout.add_widget(self.label4)
 
         root = BoxLayout(orientation='vertical')
         root.add_widget(self.wid)
         root.add_widget(layout)
 
         self.tick(0)
-        threading.Thread(target=self.draw).start()
 
         return root
 
+    def flipped(self, *args):
+        self.timers.stop('submit')
+        s = self.timers.samples
+        if s['build'] and s['submit']:
+            self.latency['draw'].record(s['build'][-1] + s['submit'][-1])
+
+    def dump_latency(self, dt=0):
+        # JSON holds the latest summary and buckets, CSV gets a row per histogram
+        # at every dump
+        now = time.time()
+        if self.latency_log.endswith('.csv'):
+            new = not os.path.exists(self.latency_log)
+            with open(self.latency_log, 'a', newline='') as f:
+                out = csv.writer(f)
+                if new:
+                    out.writerow(['time', 'histogram'] + list(SUMMARY))
+                for k, h in self.latency.items():
+                    s = h.summary()
+                    out.writerow([now, k] + [s[i] for i in SUMMARY])
+        else:
+            with open(self.latency_log, 'w') as f:
+                json.dump({'time': now, 'histograms': {k: dict(h.summary(), buckets=h.buckets())
+                                                       for k, h in self.latency.items()}}, f, indent=1)
+
+    def on_stop(self):
+        # Kivy can dispatch on_stop twice when the app stops itself
+        if self.stopped:
+            return
+        self.stopped = True
+        self.sim.stop()
+        if self.latency_log:
+            self.dump_latency()
+        if self.counter_log:
+            self.counter_file.close()
+
 
 if __name__ == '__main__':
     ParticleBox().run()
@@ -0,0 +1,118 @@
+import random
+import math as m
+
+import counters
+
+SQRT2 = m.sqrt(2)
+
+
+class Particle:
+    # rng is anything with a random() method: the random module by default, or
+    # a random.Random of its own for a repeatable run
+    def __init__(self, x, y, speed, size, id, w, h, rng=random):
+        rnd = rng.random
+        self.color = [x / w, y / w, 1]
+        self.pos = [x, y]
+        self.vel = [(2 * rnd() - 1) * speed, (2 * rnd() - 1) * speed]
+        self.mass = size * (rnd() + 1)
+        self.size = (self.mass, self.mass)
+        self.id = id
+        self.hover = False
+
+    def check_collision(self, p):
+        x1, y1 = self.pos
+        w1, h1 = self.size
+        x2, y2 = p.pos
+        w2, h2 = p.size
+
+        hit = (x1 - x2 + (w1 - w2) / 2)**2 + (y1 - y2 + (h1 - h2) / 2)**2 <= (w1 + w2)**2 / 4
+        counts = counters.counts
+        if counts is not None:
+            counts['pair_tests'] += 1
+            counts['pair_hits'] += hit
+        return bool(hit)
+
+
+class Polygon:
+    def __init__(self, pts, id, rng=random):
+        self.color = [rng.random(), rng.random(), 1]
+        self.vertex = pts[:]
+        self.normal = []
+
+        area = 0
+        for i in range(len(pts)):
+            j = (i + 1) % len(pts)
+            area += (pts[j][0] - pts[i][0]) * (pts[j][1] + pts[i][1])
+        direct = 1
+        if area > 0:
+            direct = -1
+
+        # Polygons never move, so everything check_collision needs per edge is
+        # worked out once here: the edge's line and perpendicular bisector as
+        # a * x + b * y + c (so the distance from them is just abs(a * x + b * y + c)),
+        # the midpoint and half the edge length
+        self.mid = []
+        self.line = []
+        self.bisector = []
+        self.half = []
+        for i in range(len(pts)):
+            j = (i + 1) % len(pts)
+            w = m.sqrt((pts[i][0] - pts[j][0])**2 + (pts[i][1] - pts[j][1])**2)
+            norm = w * direct
+            nx, ny = (pts[j][1] - pts[i][1]) / norm, (pts[i][0] - pts[j][0]) / norm
+            tx, ty = (pts[j][0] - pts[i][0]) / w, (pts[j][1] - pts[i][1]) / w
+            x0, y0 = (pts[i][0] + pts[j][0]) / 2, (pts[i][1] + pts[j][1]) / 2
+            self.normal += [(nx, ny)]
+            self.mid += [(x0, y0)]
+            self.line += [(nx, ny, -nx * pts[i][0] - ny * pts[i][1])]
+            self.bisector += [(tx, ty, -tx * x0 - ty * y0)]
+            self.half += [w / 2]
+
+        xs = [x for x, y in pts]
+        ys = [y for x, y in pts]
+        self.box = (min(xs), min(ys), max(xs), max(ys))
+
+        self.id = id
+
+    def check_collision(self, p, edges=None):
+        pw, ph = p.size
+        px, py = p.pos[0] + pw / 2, p.pos[1] + ph / 2
+        r = pw / 2
+
+        # An edge hits anything within r of it, which reaches at most r * sqrt(2)
+        # past the polygon's box at a corner
+        e = r * SQRT2
+        x0, y0, x1, y1 = self.box
+        if px < x0 - e or px > x1 + e or py < y0 - e or py > y1 + e:
+            return False
+
+        # edges limits the test to candidate edges, e.g. from an EdgeTree query
+        if edges is None:
+            edges = range(len(self.vertex))
+        counts = counters.counts
+        if counts is not None:
+            counts['edge_tests'] += len(edges)
+
+        d = [0] * len(self.vertex)
+        hit = [0] * len(self.vertex)
+        for i in edges:
+            a, b, c = self.line[i]
+            d[i] = abs(a * px + b * py + c)
+            if d[i] <= r:
+                a, b, c = self.bisector[i]
+                if abs(a * px + b * py + c) <= self.half[i] + r:
+                    hit[i] = 1
+
+        s = sum(hit)
+        if s == 0:
+            return False
+        for i in range(len(self.vertex)):
+            if s == 1:
+                if hit[i]:
+                    return (i, pw / 2 - d[i] + 1)
+            if s > 1:
+                j = (i + 1) % len(self.vertex)
+                if hit[i] and hit[j]:
+                    if self.normal[i][0]*p.vel[0]+self.normal[i][1]*p.vel[1] < self.normal[j][0]*p.vel[0]+self.normal[j][1]*p.vel[1]:
+                        return (i, 1)
+                    return (j, 1)
@@ -0,0 +1,252 @@
+from kivy.graphics import Canvas, InstructionGroup, RenderContext, Color, Ellipse, Mesh, Line
+
+import numpy as np
+
+
+# A renderer owns one Canvas that ParticleBox adds to the widget's canvas while
+# the renderer is selected. draw(app, snap, pos) is called once per frame with
+# the latest physics Snapshot and the particle positions to show (already
+# interpolated). Renderers never read the World, which physics is changing.
+
+def draw_polygon_build(app):
+    p = []
+    for i in app.poly_points:
+        p += [i[0] + app.wid.x, i[1] + app.wid.y]
+    Color((1, 1, 1))
+    Line(points=p, width=1)
+    if len(app.poly_points) == 1:
+        Ellipse(pos=(app.poly_points[0][0] + app.wid.x, app.poly_points[0][1] + app.wid.y), size=(5, 5))
+
+    Ellipse(pos=(app.mouse[0], app.mouse[1]), size=(5, 5))
+
+
+def draw_polygons(app, polygons):
+    for t in polygons:
+        p = []
+        indices = []
+        for i in range(len(t.vertex)):
+            p += [t.vertex[i][0] + app.wid.x, t.vertex[i][1] + app.wid.y, 0, 0]
+            indices += [i]
+            if app.show_norms:
+                x0, y0 = t.mid[i]
+                Color((1, 1, 1))
+                Line(points=[x0 + app.wid.x, y0 + app.wid.y,
+                             x0 + t.normal[i][0] * 20 + app.wid.x,
+                             y0 + t.normal[i][1] * 20 + app.wid.y], width=1)
+        Color(*t.color)
+        Mesh(vertices=p, indices=indices, mode='line_loop')
+
+
+class ImmediateRenderer:
+    # Clears and rebuilds every instruction each frame
+    name = 'immediate'
+
+    def __init__(self):
+        self.canvas = Canvas()
+
+    def reset(self):
+        pass
+
+    def draw(self, app, snap, pos):
+        self.canvas.clear()
+        with self.canvas:
+            draw_polygons(app, snap.polygons)
+
+            st = snap
+            pos = (pos + (app.wid.x, app.wid.y)).tolist()
+            for (x, y), s, c, h in zip(pos, st.size.tolist(), st.color.tolist(), st.hover.tolist()):
+                if h:
+                    Color(1, 1, 1)
+                    Ellipse(pos=(x - 2, y - 2), size=(s + 4, s + 4))
+                Color(*c)
+                Ellipse(pos=(x, y), size=(s, s))
+
+            if app.poly_build:
+                draw_polygon_build(app)
+
+
+class RetainedRenderer:
+    # Keeps one instruction group per particle and only changes their positions
+    # and colours in place. Groups are only created or removed when the number
+    # of particles changes. Polygons are kept in a cached layer.
+    name = 'retained'
+
+    def __init__(self):
+        self.canvas = Canvas()
+        self.polygon_layer = Canvas()
+        self.particle_layer = self.make_particle_layer()
+        self.overlay = Canvas()
+        self.canvas.add(self.polygon_layer)
+        self.canvas.add(self.particle_layer)
+        self.canvas.add(self.overlay)
+        self.reset()
+
+    def make_particle_layer(self):
+        return InstructionGroup()
+
+    def reset(self):
+        # Drops every retained instruction, e.g. after the scene is replaced
+        self.polygon_layer.clear()
+        self.particle_layer.clear()
+        self.particles = []
+        # Size and colour of every particle as drawn
+        self.sizes = np.zeros(0)
+        self.colors = np.zeros((0, 3))
+        self.polygon_key = None
+
+    def sync_particles(self, snap):
+        n = snap.n
+        while len(self.particles) > n:
+            self.particle_layer.remove(self.particles.pop()[0])
+
+        # A particle index can hold a different particle after a scene is
+        # loaded, or cleared and refilled, so sizes and colours are changed in
+        # place wherever they differ from what was last drawn
+        drawn = len(self.particles)
+        changed = np.flatnonzero((self.sizes[:drawn] != snap.size[:drawn]) |
+                                 (self.colors[:drawn] != snap.color[:drawn]).any(1))
+        for i in changed.tolist():
+            s = float(snap.size[i])
+            g, halo_color, halo, color, body, shown = self.particles[i]
+            halo.size = (s + 4, s + 4)
+            color.rgb = snap.color[i].tolist()
+            body.size = (s, s)
+
+        for i in range(drawn, n):
+            s = float(snap.size[i])
+            g = InstructionGroup()
+            halo_color = Color(1, 1, 1, 0)
+            halo = Ellipse(size=(s + 4, s + 4))
+            color = Color(*snap.color[i])
+            body = Ellipse(size=(s, s))
+            for k in (halo_color, halo, color, body):
+                g.add(k)
+            self.particle_layer.add(g)
+            self.particles += [[g, halo_color, halo, color, body, False]]
+        self.sizes = snap.size.copy()
+        self.colors = snap.color.copy()
+
+    def draw(self, app, snap, pos):
+        self.draw_polygons(app, snap.polygons)
+        self.draw_particles(app, snap, pos)
+
+        self.overlay.clear()
+        if app.poly_build:
+            with self.overlay:
+                draw_polygon_build(app)
+
+    def draw_polygons(self, app, polygons):
+        # Polygons never move, so they are drawn into the layer once and only
+        # redrawn when they change, the widget moves or normals are toggled
+        key = (tuple(polygons), app.wid.x, app.wid.y, app.show_norms)
+        if key == self.polygon_key:
+            return
+        self.polygon_key = key
+        self.polygon_layer.clear()
+        with self.polygon_layer:
+            draw_polygons(app, polygons)
+
+    def draw_particles(self, app, snap, pos):
+        self.sync_particles(snap)
+        for (x, y), h, k in zip((pos + (app.wid.x, app.wid.y)).tolist(), snap.hover.tolist(), self.particles):
+            g, halo_color, halo, color, body, shown = k
+            body.pos = (x, y)
+            if h:
+                halo.pos = (x - 2, y - 2)
+            if h != shown:
+                halo_color.a = 1 if h else 0
+                k[5] = h
+
+
+# Draws every particle as a quad whose corners carry texture coordinates from
+# -1 to 1, and drops the fragments outside the unit circle. The varyings have
+# the same names as Kivy's default shader so either half can be swapped alone.
+CIRCLE_VS = """
+#ifdef GL_ES
+    precision highp float;
+#endif
+attribute vec2 vPosition;
+attribute vec2 vTexCoords0;
+attribute vec3 vColor;
+uniform mat4 modelview_mat;
+uniform mat4 projection_mat;
+varying vec4 frag_color;
+varying vec2 tex_coord0;
+void main() {
+    frag_color = vec4(vColor, 1.0);
+    tex_coord0 = vTexCoords0;
+    gl_Position = projection_mat * modelview_mat * vec4(vPosition, 0.0, 1.0);
+}
+"""
+
+CIRCLE_FS = """
+#ifdef GL_ES
+    precision highp float;
+#endif
+varying vec4 frag_color;
+varying vec2 tex_coord0;
+void main() {
+    if (dot(tex_coord0, tex_coord0) > 1.0)
+        discard;
+    gl_FragColor = frag_color;
+}
+"""
+
+
+class MeshRenderer(RetainedRenderer):
+    # Draws all particles with a few Mesh instructions filled straight from the
+    # ParticleStore arrays, instead of an Ellipse per particle. Polygons use
+    # RetainedRenderer's cached layer.
+    name = 'mesh'
+
+    fmt = [(b'vPosition', 2, 'float'), (b'vTexCoords0', 2, 'float'), (b'vColor', 3, 'float')]
+    corners = np.array([(-1, -1), (1, -1), (1, 1), (-1, 1)], dtype=np.float32)
+    # Mesh indices are 16 bit, so one mesh holds at most 65536 / 4 quads
+    chunk = 16384
+
+    def make_particle_layer(self):
+        layer = RenderContext(use_parent_projection=True, use_parent_modelview=True)
+        layer.shader.fs = CIRCLE_FS
+        layer.shader.vs = CIRCLE_VS
+        return layer
+
+    def reset(self):
+        super().reset()
+        self.meshes = []
+        self.counts = []
+        self.vertices = np.zeros((0, 4, 7), dtype=np.float32)
+
+    def draw_particles(self, app, snap, pos):
+        st = snap
+        halo = np.flatnonzero(st.hover)
+
+        # Halos first so the particles are drawn over them
+        centre = pos + st.size[:, None] / 2 + (app.wid.x, app.wid.y)
+        c = np.concatenate([centre[halo], centre])
+        r = np.concatenate([st.size[halo] / 2 + 2, st.size / 2])
+        color = np.concatenate([np.ones((len(halo), 3)), st.color])
+
+        n = len(r)
+        if len(self.vertices) < n:
+            self.vertices = np.zeros((max(n, 2 * len(self.vertices)), 4, 7), dtype=np.float32)
+        v = self.vertices[:n]
+        v[:, :, :2] = c[:, None, :] + self.corners * r[:, None, None]
+        v[:, :, 2:4] = self.corners
+        v[:, :, 4:] = color[:, None, :]
+
+        chunks = (n + self.chunk - 1) // self.chunk
+        while len(self.meshes) > chunks:
+            self.particle_layer.remove(self.meshes.pop())
+            self.counts.pop()
+        while len(self.meshes) < chunks:
+            self.meshes += [Mesh(fmt=self.fmt, mode='triangles')]
+            self.counts += [0]
+            self.particle_layer.add(self.meshes[-1])
+
+        for k, mesh in enumerate(self.meshes):
+            a, b = k * self.chunk, min(n, (k + 1) * self.chunk)
+            mesh.vertices = memoryview(v[a:b].reshape(-1))
+            if self.counts[k] != b - a:
+                q = np.arange(b - a)[:, None] * 4
+                mesh.indices = (q + (0, 1, 2, 2, 3, 0)).reshape(-1).tolist()
+                self.counts[k] = b - a
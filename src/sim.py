@@ -0,0 +1,298 @@
+'''
+Simulation runners
+==================
+
+Simulation is a World plus its FixedStep and the mouse state that physics
+needs. ParticleBox never touches it directly: it sends commands by name to a
+runner and draws the runner's latest snapshot.
+
+ThreadSim steps on a thread in the same process. ProcessSim steps in a child
+process and shares state through shared memory, so heavy physics cannot hold
+the GIL while Kivy handles input. Neither imports Kivy.
+'''
+
+import threading
+import logging
+import multiprocessing as mp
+import queue
+import time
+
+import numpy as np
+
+from physics import Polygon
+from backends import BACKENDS
+from timestep import FixedStep
+from broadphase import BROADPHASES
+from snapshot import SnapshotBuffer, SharedSnapshotBuffer
+from trajectory import Recorder
+import checkpoint
+from timers import Histogram
+from domain import start
+import counters
+
+
+log = logging.getLogger(__name__)
+
+
+class Simulation:
+    def __init__(self, w, h, rate=60, substeps=1, capacity=None, backend='numpy', seed=None):
+        self.world = BACKENDS[backend](w, h, seed=seed)
+        # Physics rate in Hz and steps per physics tick, independent of the frame rate
+        self.stepper = FixedStep(self.world, rate, substeps)
+        self.capacity = capacity
+        self.broadphases = [b() for b in BROADPHASES]
+        self.world.broadphase = self.broadphases[0]
+        # Mouse position relative to the box
+        self.mouse = (0, 0)
+        self.prev_mouse = (0, 0)
+        self.clicked = False
+        self.ctrl = False
+        self.selected = -1
+        self.recorder = None
+        # Warned that the recording is leaving particles out
+        self.clipped = False
+        # Wall time of every update that stepped, sent to the UI in each snapshot
+        self.latency = Histogram()
+
+    # Commands, sent by name from ParticleBox
+
+    def add(self, n):
+        if self.capacity is not None:
+            n = min(n, self.capacity - len(self.world.particles))
+        self.world.add(n)
+
+    def sub(self, n):
+        self.world.sub(n)
+
+    def add_polygon(self, pts):
+        self.world.add_polygon(pts)
+
+    def resize(self, w, h):
+        self.world.w, self.world.h = w, h
+
+    def gravity(self, on):
+        self.world.grav = on
+
+    def inelastic(self, on):
+        self.world.e_loss = self.world.inelasticity if on else 1
+
+    def broadphase(self, i):
+        self.world.broadphase = self.broadphases[i]
+
+    def pointer(self, mouse, prev_mouse, ctrl):
+        self.mouse = mouse
+        self.prev_mouse = prev_mouse
+        self.ctrl = ctrl
+
+    def record(self, path, capacity):
+        # Appends the particles to a trajectory file after every update, until
+        # stopped. Records hold capacity particles, and any beyond those are
+        # left out rather than rewriting the file while physics waits.
+        self.recorder = Recorder(path, capacity, self.world.w, self.world.h, self.stepper.rate)
+
+    # A scene that cannot be saved or loaded is only logged, so a bad file
+    # neither stops physics nor takes the app down with it
+
+    def save(self, path):
+        try:
+            checkpoint.save(self.world, path)
+        except (ValueError, OSError) as e:
+            log.warning('Could not save %s: %s', path, e)
+
+    def load(self, path):
+        # Replaces the particles, polygons and settings with a saved scene's
+        try:
+            checkpoint.load(path, self.world)
+        except (ValueError, OSError) as e:
+            log.warning('Could not load %s: %s', path, e)
+            return
+        n = len(self.world.particles)
+        if self.capacity is not None and n > self.capacity:
+            log.warning('%s has %d particles but only %d fit, the rest are dropped and a save keeps only those',
+                        path, n, self.capacity)
+            self.world.particles.truncate(self.capacity)
+        # Nothing to interpolate from, the old positions belong to another scene
+        self.stepper.prev = self.world.particles.pos.copy()
+        self.selected = -1
+
+    def click(self):
+        self.clicked = True
+
+    def release(self):
+        if 0 <= self.selected < len(self.world.particles):
+            self.world.particles.vel[self.selected] = (self.mouse[0] - self.prev_mouse[0], self.mouse[1] - self.prev_mouse[1])
+        self.clicked = False
+        self.selected = -1
+
+    # Stepping
+
+    def handle_mouse(self):
+        st = self.world.particles
+        t = time.perf_counter()
+        mx, my = self.mouse
+        c = st.pos + st.size[:, None] / 2
+        # st.size / 2 for accuracy
+        st.hover[:] = np.hypot(mx - c[:, 0], my - c[:, 1]) < st.size
+        self.world.phases['hover'] += time.perf_counter() - t
+        if self.clicked and self.selected == -1 and st.hover.any():
+            self.selected = int(st.hover.argmax())
+            self.clicked = False
+
+        if self.ctrl:
+            return (slice(None), (self.mouse[0] - self.prev_mouse[0], self.mouse[1] - self.prev_mouse[1]))
+        elif 0 <= self.selected < len(st):
+            return (self.selected, (self.mouse[0] - self.prev_mouse[0], self.mouse[1] - self.prev_mouse[1]))
+
+    def update(self, dt, snapshots):
+        t = time.perf_counter()
+        drag = self.handle_mouse()
+        if self.stepper.advance(dt, drag):
+            self.latency.record(time.perf_counter() - t)
+            st = self.world.particles
+            # The held particle is drawn highlighted like a hovered one
+            if 0 <= self.selected < len(st):
+                st.hover[self.selected] = True
+            if self.recorder:
+                if len(st) > self.recorder.capacity and not self.clipped:
+                    log.warning('%d particles but the recording only has room for %d, the rest are left out',
+                                len(st), self.recorder.capacity)
+                self.clipped = len(st) > self.recorder.capacity
+                self.recorder.append(self.stepper.steps, st.pos, st.vel)
+            self.publish(snapshots)
+
+    def publish(self, snapshots):
+        snapshots.publish(self.world, self.stepper.prev, self.stepper.rate, self.latency)
+        self.world.reset_phases()
+        counters.take()
+
+    def close(self):
+        self.world.close()
+        if self.recorder:
+            self.recorder.close()
+
+    def wait(self):
+        # Sleeps until the next physics step is due
+        time.sleep(max(0, 1 / self.stepper.rate - self.stepper.acc))
+
+
+def run_commands(sim, commands):
+    # Runs every queued command, False once one asks to stop
+    while True:
+        try:
+            cmd, args = commands.get_nowait()
+        except queue.Empty:
+            return True
+        if cmd == 'stop':
+            return False
+        getattr(sim, cmd)(*args)
+
+
+# Particles a ProcessSim has room for, and so the default for a recording
+CAPACITY = 100000
+
+
+class ThreadSim:
+    def __init__(self, w, h, rate=60, substeps=1, backend='numpy', seed=None):
+        self.sim = Simulation(w, h, rate, substeps, backend=backend, seed=seed)
+        # Commands wait here for the physics thread instead of taking a lock
+        # it holds through every step, so sending one never blocks a frame
+        self.commands = queue.SimpleQueue()
+        self.snapshots = SnapshotBuffer()
+        self.sim.publish(self.snapshots)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def command(self, name, *args):
+        self.commands.put((name, args))
+
+    def latest(self):
+        return self.snapshots.latest()
+
+    def run(self):
+        last = time.perf_counter()
+        while run_commands(self.sim, self.commands):
+            now = time.perf_counter()
+            self.sim.update(now - last, self.snapshots)
+            last = now
+            self.sim.wait()
+
+    def stop(self):
+        # The thread finishes its update first, so nothing steps a closed world
+        self.commands.put(('stop', ()))
+        self.thread.join()
+        self.sim.close()
+
+
+def run_process(name, capacity, lock, commands, polygons, w, h, rate, substeps, backend, counting, seed):
+    if counting:
+        counters.enable()
+    sim = Simulation(w, h, rate, substeps, capacity, backend, seed)
+    snapshots = SharedSnapshotBuffer(capacity, lock, name)
+    sim.publish(snapshots)
+
+    parent = mp.parent_process()
+    last = time.perf_counter()
+    sent = ()
+    try:
+        while parent.is_alive():
+            if not run_commands(sim, commands):
+                return
+            # The UI draws its own copy of the polygons, sent whenever the list
+            # changes, colours included
+            if sent != tuple(sim.world.polygons):
+                sent = tuple(sim.world.polygons)
+                polygons.put([(t.vertex, t.color) for t in sent])
+
+            now = time.perf_counter()
+            sim.update(now - last, snapshots)
+            last = now
+            sim.wait()
+    finally:
+        # Polygons the UI never read are dropped rather than waited on
+        polygons.cancel_join_thread()
+        sim.close()
+        snapshots.close()
+
+
+def polygon(pts, id, color):
+    t = Polygon(pts, id)
+    t.color = color
+    return t
+
+
+class ProcessSim:
+    def __init__(self, w, h, rate=60, substeps=1, backend='numpy', capacity=CAPACITY, seed=None):
+        # spawn, so the child does not inherit Kivy's window and GL state
+        ctx = mp.get_context('spawn')
+        self.lock = ctx.Lock()
+        self.snapshots = SharedSnapshotBuffer(capacity, self.lock)
+        self.commands = ctx.Queue()
+        self.polygons = ctx.Queue()
+        # Not a daemon, since the parallel backend starts processes of its own.
+        # It stops when asked to or when this process is gone.
+        self.process = ctx.Process(target=run_process,
+                                   args=(self.snapshots.shm.name, capacity, self.lock, self.commands, self.polygons,
+                                         w, h, rate, substeps, backend,
+                                         counters.counts is not None, seed))
+        start(self.process)
+
+    def command(self, name, *args):
+        self.commands.put((name, args))
+
+    def latest(self):
+        # Only the newest polygon list the child sent matters
+        data = None
+        while True:
+            try:
+                data = self.polygons.get_nowait()
+            except queue.Empty:
+                break
+        if data is not None:
+            self.snapshots.polygons = tuple(polygon(pts, k, color) for k, (pts, color) in enumerate(data))
+        return self.snapshots.latest()
+
+    def stop(self):
+        self.commands.put(('stop', ()))
+        self.process.join(5)
+        self.snapshots.close()
+        self.snapshots.unlink()
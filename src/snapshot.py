@@ -0,0 +1,199 @@
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import counters
+from counters import PHYSICS_COUNTERS
+from domain import close
+from timers import PHYSICS_PHASES, HISTOGRAM_STATE
+
+
+class Snapshot:
+    # Everything the renderer needs from one physics step. The arrays are
+    # reused between steps and only reallocated when the particle count grows.
+
+    def __init__(self):
+        self.n = 0
+        self.step = -1
+        self.time = 0
+        self.rate = 60
+        self.polygons = ()
+        # Seconds world spent in each of PHYSICS_PHASES since the last snapshot
+        self.phases = np.zeros(len(PHYSICS_PHASES))
+        # PHYSICS_COUNTERS since the last snapshot, zero when not counting
+        self.counts = np.zeros(len(PHYSICS_COUNTERS), dtype=np.int64)
+        # Histogram of every physics update so far, see Histogram.store
+        self.latency = np.zeros(HISTOGRAM_STATE, dtype=np.int64)
+        self._pos = np.zeros((0, 2))
+        self._prev = np.zeros((0, 2))
+        self._size = np.zeros(0)
+        self._color = np.zeros((0, 3))
+        self._hover = np.zeros(0, dtype=bool)
+        self.views()
+
+    def reserve(self, n):
+        if len(self._pos) < n:
+            self._pos = np.zeros((n, 2))
+            self._prev = np.zeros((n, 2))
+            self._size = np.zeros(n)
+            self._color = np.zeros((n, 3))
+            self._hover = np.zeros(n, dtype=bool)
+
+    def views(self):
+        self.pos = self._pos[:self.n]
+        self.prev = self._prev[:self.n]
+        self.size = self._size[:self.n]
+        self.color = self._color[:self.n]
+        self.hover = self._hover[:self.n]
+
+    def fill(self, world, prev, step, rate, latency):
+        st = world.particles
+        self.n = n = len(st)
+        self.reserve(n)
+        self.views()
+
+        np.copyto(self.pos, st.pos)
+        np.copyto(self.size, st.size)
+        np.copyto(self.color, st.color)
+        np.copyto(self.hover, st.hover)
+        # Particles added since the previous step start from where they are now
+        k = min(n, len(prev))
+        self.prev[:k] = prev[:k]
+        self.prev[k:] = st.pos[k:]
+        # Polygons are never changed once built, so a copy of the list is enough
+        self.polygons = tuple(world.polygons)
+        self.phases[:] = [world.phases[k] for k in PHYSICS_PHASES]
+        c = counters.counts
+        self.counts[:] = [c[k] for k in PHYSICS_COUNTERS] if c is not None else 0
+        latency.store(self.latency)
+        self.step = step
+        self.rate = rate
+        self.time = time.perf_counter()
+
+    def positions(self, now=None):
+        # Interpolates from the previous step towards this one, reaching it one
+        # physics step after it was published
+        if now is None:
+            now = time.perf_counter()
+        a = min(max((now - self.time) * self.rate, 0), 1)
+        return self.prev + (self.pos - self.prev) * a
+
+
+class SnapshotBuffer:
+    # Triple buffer between the physics thread (publish) and the render thread
+    # (latest). The writer always has a slot of its own to fill, the reader
+    # always keeps the slot it is reading, and the lock is only held to swap
+    # slot indices, never while copying or drawing.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slots = [Snapshot(), Snapshot(), Snapshot()]
+        self.back = 0
+        self.ready = 1
+        self.front = 2
+        self.fresh = False
+        self.steps = 0
+
+    def publish(self, world, prev, rate, latency):
+        self.slots[self.back].fill(world, prev, self.steps, rate, latency)
+        self.steps += 1
+        with self.lock:
+            self.back, self.ready = self.ready, self.back
+            self.fresh = True
+
+    def latest(self):
+        with self.lock:
+            if self.fresh:
+                self.front, self.ready = self.ready, self.front
+                self.fresh = False
+        return self.slots[self.front]
+
+
+class SharedSnapshot(Snapshot):
+    # A Snapshot whose arrays live in a shared memory block at offset, so one
+    # process can fill it and another draw it. n, step, time and rate are kept
+    # in the block too and read back with load().
+
+    def __init__(self, buf, offset, capacity):
+        def array(shape, dtype=float):
+            nonlocal offset
+            a = np.ndarray(shape, dtype, buf, offset)
+            offset += a.nbytes
+            return a
+
+        self.meta = array(4)
+        self.phases = array(len(PHYSICS_PHASES))
+        self.counts = array(len(PHYSICS_COUNTERS), np.int64)
+        self.latency = array(HISTOGRAM_STATE, np.int64)
+        self._pos = array((capacity, 2))
+        self._prev = array((capacity, 2))
+        self._size = array(capacity)
+        self._color = array((capacity, 3))
+        self._hover = array(capacity, bool)
+        self.polygons = ()
+        self.load()
+
+    @staticmethod
+    def nbytes(capacity):
+        return 8 * (4 + len(PHYSICS_PHASES) + len(PHYSICS_COUNTERS) + HISTOGRAM_STATE + capacity * 8) + capacity
+
+    def reserve(self, n):
+        if len(self._pos) < n:
+            raise ValueError('%d particles do not fit in a snapshot of %d' % (n, len(self._pos)))
+
+    def fill(self, world, prev, step, rate, latency):
+        super().fill(world, prev, step, rate, latency)
+        self.meta[:] = self.n, self.step, self.time, self.rate
+
+    def load(self):
+        n, step, t, rate = self.meta.tolist()
+        self.n, self.step, self.time, self.rate = int(n), int(step), t, rate
+        self.views()
+
+
+def ctrl_field(i):
+    return property(lambda self: int(self.ctrl[i]), lambda self, v: self.ctrl.__setitem__(i, v))
+
+
+class SharedSnapshotBuffer(SnapshotBuffer):
+    # SnapshotBuffer over shared memory, for a physics process and a UI process.
+    # The slot indices live in the block as well, so both sides swap the same
+    # slots; lock has to be a multiprocessing lock. Created when name is None,
+    # otherwise attached to the block of that name. Polygons are not shared:
+    # the UI keeps its own copy in polygons and latest() hands that out.
+
+    back = ctrl_field(0)
+    ready = ctrl_field(1)
+    front = ctrl_field(2)
+    fresh = ctrl_field(3)
+    steps = ctrl_field(4)
+
+    def __init__(self, capacity, lock, name=None):
+        self.lock = lock
+        self.polygons = ()
+        size = 40 + 3 * SharedSnapshot.nbytes(capacity)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+        self.ctrl = np.ndarray(5, np.int64, self.shm.buf)
+        self.slots = [SharedSnapshot(self.shm.buf, 40 + k * SharedSnapshot.nbytes(capacity), capacity) for k in range(3)]
+        if name is None:
+            self.ctrl[:] = 0, 1, 2, 0, 0
+            for s in self.slots:
+                s.meta[:] = 0, -1, 0, 60
+
+    def latest(self):
+        snap = super().latest()
+        snap.load()
+        snap.polygons = self.polygons
+        return snap
+
+    def close(self):
+        self.ctrl = self.slots = None
+        close(self.shm)
+
+    def unlink(self):
+        self.shm.unlink()
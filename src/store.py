@@ -0,0 +1,115 @@
+import numpy as np
+
+from physics import Particle
+
+
+class ParticleStore:
+    # Structure of arrays particle storage. Every field is one contiguous array
+    # indexed by particle, so physics and drawing can work on all particles at
+    # once. The arrays are allocated with spare capacity and the public fields
+    # are views of the first n rows.
+
+    fields = (('pos', (2,), float),
+              ('vel', (2,), float),
+              ('mass', (), float),
+              ('size', (), float),
+              ('color', (3,), float),
+              ('hover', (), bool))
+
+    def __init__(self, capacity=64):
+        self.n = 0
+        self.capacity = 0
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        for k, shape, dtype in self.fields:
+            a = np.zeros((capacity,) + shape, dtype=dtype)
+            if self.capacity:
+                a[:self.n] = getattr(self, '_' + k)[:self.n]
+            setattr(self, '_' + k, a)
+        self.capacity = capacity
+        self.views()
+
+    def views(self):
+        for k, shape, dtype in self.fields:
+            setattr(self, k, getattr(self, '_' + k)[:self.n])
+
+    def resize(self, n):
+        if n > self.capacity:
+            self.grow(max(n, 2 * self.capacity))
+        self.n = n
+        self.views()
+
+    def extend(self, particles):
+        if not particles:
+            return
+        i = self.n
+        self.resize(i + len(particles))
+        self.pos[i:] = [p.pos for p in particles]
+        self.vel[i:] = [p.vel for p in particles]
+        self.mass[i:] = [p.mass for p in particles]
+        self.size[i:] = [p.size[0] for p in particles]
+        self.color[i:] = [p.color for p in particles]
+        self.hover[i:] = False
+
+    def truncate(self, n):
+        self.resize(max(0, min(n, self.n)))
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if not -self.n <= i < self.n:
+            raise IndexError(i)
+        return ParticleView(self, i % self.n)
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield ParticleView(self, i)
+
+
+class ParticleView(Particle):
+    # A Particle backed by one row of a ParticleStore, so the per particle code
+    # (check_collision, p_collision, t_collision) still works on stored particles.
+    # pos and vel are writable numpy rows.
+
+    def __init__(self, store, i):
+        self.store = store
+        self.id = i
+
+    @property
+    def pos(self):
+        return self.store.pos[self.id]
+
+    @pos.setter
+    def pos(self, v):
+        self.store.pos[self.id] = v
+
+    @property
+    def vel(self):
+        return self.store.vel[self.id]
+
+    @vel.setter
+    def vel(self, v):
+        self.store.vel[self.id] = v
+
+    @property
+    def mass(self):
+        return self.store.mass[self.id]
+
+    @property
+    def size(self):
+        s = self.store.size[self.id]
+        return (s, s)
+
+    @property
+    def color(self):
+        return self.store.color[self.id]
+
+    @property
+    def hover(self):
+        return self.store.hover[self.id]
+
+    @hover.setter
+    def hover(self, v):
+        self.store.hover[self.id] = v
@@ -0,0 +1,118 @@
+import time
+from collections import deque
+
+import numpy as np
+
+
+# Physics phases are timed by World.step (and Simulation for hover) and travel
+# to the UI in every Snapshot, render phases are timed by ParticleBox
+PHYSICS_PHASES = ('pairs', 'polygons', 'hover', 'integrate')
+RENDER_PHASES = ('build', 'submit', 'frame')
+PHASES = PHYSICS_PHASES + RENDER_PHASES
+
+
+class Timers:
+    # Rolling window of the last samples of each phase, in seconds. Physics
+    # phases get one sample per published snapshot, render phases one per frame.
+
+    def __init__(self, phases=PHASES, window=120):
+        self.samples = {k: deque(maxlen=window) for k in phases}
+        self.started = {}
+
+    def record(self, phase, t):
+        self.samples[phase].append(t)
+
+    def start(self, phase):
+        self.started[phase] = time.perf_counter()
+
+    def stop(self, phase):
+        if phase in self.started:
+            self.record(phase, time.perf_counter() - self.started.pop(phase))
+
+    def mean(self, phase):
+        s = self.samples[phase]
+        return sum(s) / len(s) if s else 0
+
+    def max(self, phase):
+        return max(self.samples[phase], default=0)
+
+    def stats(self):
+        # {phase: (mean ms, max ms)}, for the overlay or a log
+        return {k: (self.mean(k) * 1000, self.max(k) * 1000) for k in self.samples}
+
+
+class Histogram:
+    # Latency histogram in the style of HdrHistogram: fixed memory and O(1)
+    # record, at a fixed relative precision over the whole range. Values are
+    # whole microseconds. Below 2**bits every value has its own bucket, above it
+    # the buckets of each power of two keep bits significant bits, so any value
+    # read back is within 2 / 2**bits (1.6% for 7 bits) of what was recorded.
+
+    def __init__(self, bits=7, max_seconds=60):
+        self.bits = bits
+        self.sub = 1 << bits
+        self.top = int(max_seconds * 1e6)
+        self.counts = np.zeros(self.index(self.top) + 1, dtype=np.int64)
+        self.reset()
+
+    def reset(self):
+        self.counts[:] = 0
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+    def index(self, v):
+        if v < self.sub:
+            return v
+        shift = v.bit_length() - self.bits
+        return self.sub + (shift - 1) * (self.sub // 2) + (v >> shift) - self.sub // 2
+
+    def value(self, i):
+        # The highest value that lands in bucket i
+        if i < self.sub:
+            return i
+        shift, k = divmod(i - self.sub, self.sub // 2)
+        shift += 1
+        return ((k + self.sub // 2 + 1) << shift) - 1
+
+    def record(self, seconds):
+        v = min(max(int(seconds * 1e6), 0), self.top)
+        self.counts[self.index(v)] += 1
+        self.n += 1
+        self.total += v
+        self.max = max(self.max, v)
+
+    def store(self, out):
+        # n, total, max and the counts into out, an int64 array of
+        # HISTOGRAM_STATE, so a histogram can travel in a Snapshot
+        out[:3] = self.n, self.total, self.max
+        out[3:] = self.counts
+
+    def load(self, a):
+        # Back from an array filled by store
+        self.n, self.total, self.max = a[:3].tolist()
+        np.copyto(self.counts, a[3:])
+
+    def percentile(self, p):
+        # In seconds, 0 while empty
+        if not self.n:
+            return 0
+        i = int(np.searchsorted(np.cumsum(self.counts), max(1, int(np.ceil(self.n * p / 100)))))
+        return min(self.value(i), self.max) / 1e6
+
+    def summary(self):
+        # Milliseconds, for the overlay and the dumps
+        out = {'count': self.n, 'mean': self.total / self.n / 1000 if self.n else 0}
+        for p in (50, 95, 99, 99.9):
+            out['p%g' % p] = self.percentile(p) * 1000
+        out['max'] = self.max / 1000
+        return out
+
+    def buckets(self):
+        # (highest value in ms, count) of every bucket in use
+        return [(self.value(i) / 1000, int(self.counts[i])) for i in np.flatnonzero(self.counts)]
+
+
+# Keys of Histogram.summary, in order
+SUMMARY = ('count', 'mean', 'p50', 'p95', 'p99', 'p99.9', 'max')
+HISTOGRAM_STATE = 3 + len(Histogram().counts)
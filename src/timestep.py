@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class FixedStep:
+    # Runs World.step at a fixed rate however often it is called, so the
+    # simulation speed does not depend on the frame rate. prev keeps the
+    # positions before the last step, which snapshots interpolate from.
+
+    def __init__(self, world, rate=60, substeps=1, max_steps=5):
+        self.world = world
+        self.rate = rate
+        self.substeps = substeps
+        # Steps allowed per advance() before falling behind, so a slow host drops
+        # time instead of spending ever longer catching up
+        self.max_steps = max_steps
+        self.acc = 0
+        # Steps taken so far
+        self.steps = 0
+        self.prev = world.particles.pos.copy()
+
+    def advance(self, dt, drag=None):
+        self.acc += dt
+        h = self.world.base_rate / self.rate / self.substeps
+
+        n = 0
+        while self.acc >= 1 / self.rate:
+            if n == self.max_steps:
+                self.acc = 0
+                break
+            pos = self.world.particles.pos
+            if self.prev.shape == pos.shape:
+                np.copyto(self.prev, pos)
+            else:
+                self.prev = pos.copy()
+            for _ in range(self.substeps):
+                self.world.step(drag, h)
+            self.acc -= 1 / self.rate
+            self.steps += 1
+            n += 1
+        return n
@@ -0,0 +1,123 @@
+'''
+Trajectory recording
+====================
+
+Recorder appends the particle positions and velocities of every physics step
+to a memory mapped file, and Recording reads any step of it back without
+loading the rest:
+
+    rec = Recording('run.traj')
+    step, t, pos, vel = rec[1000]
+
+The file is a 64 byte header followed by fixed size records, one per step, so
+record i always starts at 64 + i * record_size. Every record has room for
+capacity particles, fixed when recording starts, and n says how many there
+are. A step with more particles than that only keeps the first capacity of
+them, so appending never has to move the records already written. Slots no
+step filled are never written either, and stay holes in the file where the
+file system allows. Record layout, little endian:
+
+    step     int64
+    time     float64   seconds since recording started
+    n        int64     particles stored
+    pos      float64   (capacity, 2)
+    vel      float64   (capacity, 2)
+'''
+
+import mmap
+import struct
+import time
+
+import numpy as np
+
+
+MAGIC = b'PBTRAJ\0\0'
+VERSION = 1
+# magic, version, capacity, frames, record size, w, h, rate
+HEADER = struct.Struct('<8sIIqqddd')
+HEADER_SIZE = 64
+
+
+def record_dtype(capacity):
+    return np.dtype([('step', '<i8'), ('time', '<f8'), ('n', '<i8'),
+                     ('pos', '<f8', (capacity, 2)), ('vel', '<f8', (capacity, 2))])
+
+
+class Recorder:
+    # The file grows by doubling, so appending only copies the two arrays into
+    # the mapping and remaps now and then
+
+    def __init__(self, path, capacity=64, w=0, h=0, rate=60, frames=64):
+        self.capacity = capacity
+        self.dtype = record_dtype(capacity)
+        self.w, self.h, self.rate = w, h, rate
+        self.frames = 0
+        self.start = time.perf_counter()
+        self.file = open(path, 'w+b')
+        self.map(frames)
+
+    def map(self, frames):
+        self.allocated = frames
+        self.file.truncate(HEADER_SIZE + frames * self.dtype.itemsize)
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        self.records = np.ndarray(frames, self.dtype, self.mm, HEADER_SIZE)
+        self.write_header()
+
+    def unmap(self):
+        self.records = None
+        self.mm.close()
+
+    def write_header(self):
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, self.capacity, self.frames,
+                         self.dtype.itemsize, self.w, self.h, self.rate)
+
+    def append(self, step, pos, vel):
+        if self.frames == self.allocated:
+            self.unmap()
+            self.map(2 * self.allocated)
+        n = min(len(pos), self.capacity)
+        r = self.records[self.frames]
+        r['step'] = step
+        r['time'] = time.perf_counter() - self.start
+        r['n'] = n
+        r['pos'][:n] = pos[:n]
+        r['vel'][:n] = vel[:n]
+        self.frames += 1
+        # frames only counts complete records, so a cut off file still reads
+        self.write_header()
+
+    def close(self):
+        self.mm.flush()
+        self.unmap()
+        self.file.truncate(HEADER_SIZE + self.frames * self.dtype.itemsize)
+        self.file.close()
+
+
+class Recording:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.capacity, self.frames, size, self.w, self.h, self.rate = HEADER.unpack_from(self.mm)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a version %d trajectory' % (path, VERSION))
+        dtype = record_dtype(self.capacity)
+        if size != dtype.itemsize:
+            raise ValueError('%s has %d byte records, expected %d' % (path, size, dtype.itemsize))
+        self.frames = min(self.frames, (len(self.mm) - HEADER_SIZE) // size)
+        self.records = np.ndarray(self.frames, dtype, self.mm, HEADER_SIZE)
+
+    def __len__(self):
+        return self.frames
+
+    def __getitem__(self, i):
+        # (step, time, pos, vel) of record i, pos and vel are read only views
+        if not -self.frames <= i < self.frames:
+            raise IndexError(i)
+        r = self.records[i]
+        n = int(r['n'])
+        return int(r['step']), float(r['time']), r['pos'][:n], r['vel'][:n]
+
+    def close(self):
+        self.records = None
+        self.mm.close()
+        self.file.close()
@@ -0,0 +1,267 @@
+'''
+Headless particle world
+=======================
+
+All of the simulation, without Kivy. ParticleBox drives a World for display,
+and it can be stepped on its own on machines without a screen:
+
+    python world.py --particles 2000 --steps 500
+    python world.py --particles 500 --steps 100 --backend python numpy parallel
+'''
+
+import random
+import math as m
+import time
+import argparse
+
+from physics import Particle, Polygon
+from store import ParticleStore
+from broadphase import SortedGrid
+from narrow import collide_pairs, collide_polygons, PolygonTable
+from bvh import EdgeTree
+from timers import PHYSICS_PHASES, Histogram
+import counters
+
+
+class World:
+    base_rate = 60
+    # What polygon_table builds over the polygons for step to collide with
+    polygon_index = PolygonTable
+
+    def __init__(self, w, h, seed=None):
+        self.w = w
+        self.h = h
+        self.speed = 3
+        self.size = 20
+        self.inelasticity = 0.95
+        self.grav = False
+        self.e_loss = 1
+        self.particles = ParticleStore()
+        self.polygons = []
+        self.broadphase = SortedGrid()
+        # Edge geometry of the polygons, rebuilt when they change
+        self.table = None
+        # Every random number the world draws (spawn positions, velocities,
+        # masses, polygon colours) comes from here, so worlds with the same seed
+        # and the same commands step identically. None seeds it from the system.
+        self.rng = random.Random(seed)
+        self.reset_phases()
+
+    def reset_phases(self):
+        # Seconds spent in each phase of step since the last reset
+        self.phases = dict.fromkeys(PHYSICS_PHASES, 0.0)
+
+    def add(self, n):
+        rnd = self.rng.random
+        self.particles.extend([Particle(rnd() * self.w, rnd() * self.h, self.speed,
+                               self.size, len(self.particles) + i, self.w, self.h, self.rng) for i in range(n)])
+
+    def sub(self, n):
+        if not n:
+            n = len(self.particles)
+        self.particles.truncate(len(self.particles) - n)
+
+    def add_polygon(self, pts):
+        self.polygons += [Polygon(pts, len(self.polygons), self.rng)]
+
+    def p_collision(self, p1, p2):
+        if p1.check_collision(p2):
+            x1, y1 = p1.pos
+            x2, y2 = p2.pos
+            w1, h1 = p1.size
+            w2, h2 = p2.size
+
+            m1 = p2.mass / p1.mass
+            m2 = p1.mass / p2.mass
+
+            p1.vel, p2.vel = [m1 * p2.vel[0] * self.e_loss,
+                              m1 * p2.vel[1] * self.e_loss], [m2 * p1.vel[0] * self.e_loss,
+                              m2 * p1.vel[1] * self.e_loss]
+
+            if x1 != p2.pos[0]:
+                g = m.atan(abs(y1 - y2) / abs(x1 - x2))
+            else:
+                g = m.pi * (1 if y1 > y2 else -1) / 2
+
+            d = ((h1 + h2) / 2 - m.sqrt((x1 - x2 + (w1 - w2) / 2)**2 + (y1 - y2 + (h1 - h2) / 2)**2)) / 2
+            dx = m.cos(g) * d * (-1 if x2 > x1 else 1) + 1
+            dy = m.sin(g) * d * (-1 if y2 > y1 else 1) + 1
+            p1.pos = [p1.pos[0] + dx, p1.pos[1] + dy]
+            p2.pos = [p2.pos[0] - dx, p2.pos[1] - dy]
+
+    def t_collision(self, p, t, edges=None):
+        v = t.check_collision(p, edges)
+        if v:
+            counts = counters.counts
+            if counts is not None:
+                counts['polygon_hits'] += 1
+            n = t.normal[v[0]]
+
+            n_dot_v = n[0] * p.vel[0] + n[1] * p.vel[1]
+
+            p.vel[0] = (p.vel[0] - 2 * n[0] * n_dot_v) * self.e_loss
+            p.pos[0] += n[0] * v[1]
+            p.vel[1] = (p.vel[1] - 2 * n[1] * n_dot_v) * self.e_loss
+            p.pos[1] += n[1] * v[1]
+            return True
+
+    def wall_collision(self, st):
+        over = st.pos + st.size[:, None] - (self.w, self.h)
+        hi = over > 0
+        lo = (st.pos < 0) & ~hi
+
+        st.vel[hi | lo] *= -1 * self.e_loss
+        st.pos[hi] -= over[hi]
+        st.pos[lo] = 0
+
+    def step(self, drag=None, h=1):
+        # drag is (index, velocity) for particles held by the mouse, where index
+        # is a particle index or slice(None) for all of them. h is the length of
+        # the step in frames; velocities are in pixels per frame at base_rate.
+        st = self.particles
+        t0 = time.perf_counter()
+        if hasattr(self.broadphase, 'pair_array'):
+            pairs = self.broadphase.pair_array(st.pos, st.size)
+        else:
+            pairs = self.broadphase.pairs(st.pos.tolist(), st.size.tolist())
+        collide_pairs(st, pairs, self.e_loss)
+        t1 = time.perf_counter()
+
+        collide_polygons(st, self.polygon_table(), self.e_loss)
+        t2 = time.perf_counter()
+
+        if drag is not None:
+            st.vel[drag[0]] = drag[1]
+
+        st.pos += st.vel * h
+
+        self.wall_collision(st)
+
+        if self.grav:
+            st.vel[:, 1] -= 0.2 * h
+            st.vel[:, 1] *= self.inelasticity ** h
+        self.timed(t0, t1, t2)
+
+    def polygon_table(self):
+        # Compared by identity, as loading a scene replaces the polygons
+        if self.table is None or self.table.polygons != tuple(self.polygons):
+            self.table = self.polygon_index(self.polygons)
+        return self.table
+
+    def timed(self, t0, t1, t2):
+        ph = self.phases
+        ph['pairs'] += t1 - t0
+        ph['polygons'] += t2 - t1
+        ph['integrate'] += time.perf_counter() - t2
+
+    def close(self):
+        pass
+
+
+class PythonWorld(World):
+    # The same phases one particle or pair at a time with p_collision and
+    # t_collision: every pair first, each applied before the next, then every
+    # particle's polygons, then integration. It is a different pair model from
+    # collide_pairs, which averages a particle's pairs and pushes along the
+    # line between centres, so the two only agree on isolated pairs of equal
+    # size (bench/kernels.py --check). Polygon collisions are the same to the
+    # bit. Each particle only tests the polygon edges an EdgeTree finds near it.
+    polygon_index = EdgeTree
+
+    def wall_collision_one(self, p1):
+        if p1.pos[0] + p1.size[0] > self.w:
+            p1.vel[0] *= -1 * self.e_loss
+            p1.pos[0] -= p1.pos[0] + p1.size[0] - self.w
+        elif p1.pos[0] < 0:
+            p1.vel[0] *= -1 * self.e_loss
+            p1.pos[0] -= p1.pos[0]
+        if p1.pos[1] + p1.size[1] > self.h:
+            p1.vel[1] *= -1 * self.e_loss
+            p1.pos[1] -= p1.pos[1] + p1.size[1] - self.h
+        elif p1.pos[1] < 0:
+            p1.vel[1] *= -1 * self.e_loss
+            p1.pos[1] -= p1.pos[1]
+
+    def step(self, drag=None, h=1):
+        st = self.particles
+        t0 = time.perf_counter()
+        particles = list(st)
+        for i, j in self.broadphase.pairs(st.pos.tolist(), st.size.tolist()):
+            self.p_collision(particles[i], particles[j])
+        t1 = time.perf_counter()
+
+        tree = self.polygon_table()
+        for p1 in particles:
+            near = tree.query(p1)
+            while near:
+                t, edges = near.pop(0)
+                if self.t_collision(p1, t, edges):
+                    # The push can bring p1 near polygons it was not near before
+                    near = [k for k in tree.query(p1) if k[0].id > t.id]
+        t2 = time.perf_counter()
+
+        if drag is not None:
+            st.vel[drag[0]] = drag[1]
+
+        for p1 in particles:
+            p1.pos = [p1.pos[0] + p1.vel[0] * h, p1.pos[1] + p1.vel[1] * h]
+
+            self.wall_collision_one(p1)
+
+            if self.grav:
+                p1.vel[1] -= 0.2 * h
+                p1.vel[1] *= self.inelasticity ** h
+        self.timed(t0, t1, t2)
+
+
+def main():
+    from backends import BACKENDS, default_backend
+    from trajectory import Recorder
+    import checkpoint
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backend', choices=sorted(BACKENDS), nargs='+', default=[default_backend()])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--record', help='trajectory file to write every step to')
+    parser.add_argument('--load', help='scene file to start from instead of random particles')
+    parser.add_argument('--save', help='scene file to write after the last step')
+    parser.add_argument('--particles', type=int, default=1000)
+    parser.add_argument('--steps', type=int, default=500)
+    parser.add_argument('--size', type=int, nargs=2, default=(800, 550))
+    parser.add_argument('--grav', action='store_true')
+    args = parser.parse_args()
+
+    # Every backend starts from the same scene
+    for name in args.backend:
+        world = BACKENDS[name](*args.size, seed=args.seed)
+        world.grav = args.grav
+        if args.load:
+            checkpoint.load(args.load, world)
+        else:
+            world.add(args.particles)
+
+        recorder = None
+        if args.record:
+            recorder = Recorder(args.record, len(world.particles), world.w, world.h, world.base_rate)
+
+        latency = Histogram()
+        s = time.perf_counter()
+        for i in range(args.steps):
+            t = time.perf_counter()
+            world.step()
+            if recorder:
+                recorder.append(i + 1, world.particles.pos, world.particles.vel)
+            latency.record(time.perf_counter() - t)
+        t = time.perf_counter() - s
+        if args.save:
+            checkpoint.save(world, args.save)
+        world.close()
+        if recorder:
+            recorder.close()
+        l = latency.summary()
+        print('%-8s %d particles, %d steps in %.2f s, %.1f steps/s, p50 %.2f p99 %.2f max %.2f ms' % (
+            name, len(world.particles), args.steps, t, args.steps / t, l['p50'], l['p99'], l['max']))
+
+
+if __name__ == '__main__':
+    main()